@@ -0,0 +1,160 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+
+from recipes.ingredient_index import ingredient_index
+from recipes.models import CookingRecipe
+from .authentication import CachedTokenAuthentication
+from .cache import (
+    HITS_KEY, MISSES_KEY, aget_generation, aincrement_stat,
+    get_response_cache_key
+)
+from .conditional import aget_user_state, build_validators, conditional_headers
+from .serializers import CookingRecipeReadSerializer
+
+READ_METHODS = ('GET', 'HEAD')
+renderer = JSONRenderer()
+authentication = CachedTokenAuthentication()
+
+
+def json_response(data, status=200, **kwargs):
+    response = HttpResponse(
+        renderer.render(data), content_type=renderer.media_type,
+        status=status, **kwargs
+    )
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def is_json_read(request):
+    """GET в формате JSON; остальное, включая Browsable API,
+    обрабатывают синхронные представления DRF"""
+    return (
+        request.method in READ_METHODS
+        and 'format' not in request.GET
+        and 'text/html' not in request.headers.get('Accept', '')
+    )
+
+
+def async_read_view(async_view):
+    """Асинхронное представление для чтения JSON. Остальные запросы
+    по тому же адресу передаются синхронному view DRF из sync_view.
+    Как и APIView.as_view, освобождено от CSRF: DRF проверяет его
+    сам при аутентификации по сессии."""
+    @csrf_exempt
+    @wraps(async_view)
+    async def view(request, *args, sync_view, **kwargs):
+        if not is_json_read(request):
+            return await sync_to_async(sync_view)(request, *args, **kwargs)
+        try:
+            user = await authenticate(request)
+        except exceptions.AuthenticationFailed as error:
+            return json_response(
+                {'detail': error.detail}, status=error.status_code,
+                headers={'WWW-Authenticate': authentication.authenticate_header(request)}
+            )
+        return await async_view(request, user, *args, **kwargs)
+    return view
+
+
+async def authenticate(request):
+    result = await authentication.aauthenticate(request)
+    return result[0] if result else AnonymousUser()
+
+
+async def conditional_json(request, user, state, get_data, use_last_modified=True):
+    """Ответ JSON с теми же ETag и Last-Modified, что у ConditionalGetMixin"""
+    etag, last_modified = build_validators(
+        request, renderer.format, user, state, await aget_user_state(user),
+        use_last_modified
+    )
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = json_response(await get_data())
+    return conditional_headers(response, etag, last_modified)
+
+
+@async_read_view
+async def ingredient_list(request, user):
+    """Список продуктов из префиксного индекса"""
+    # Один снимок на запрос: сброс индекса сигналом между await
+    # не приведёт к запросу в БД из цикла событий.
+    snapshot = await ingredient_index.aload()
+
+    async def get_data():
+        search_term = request.GET.get('name') or request.GET.get('title')
+        if search_term:
+            return ingredient_index.search(search_term, snapshot=snapshot)
+        return ingredient_index.all(snapshot)
+
+    return await conditional_json(
+        request, user, ingredient_index.modification_state(snapshot), get_data,
+        use_last_modified=False
+    )
+
+
+@async_read_view
+async def recipe_detail(request, user, pk):
+    """Рецепт, как CookingRecipeViewSet.retrieve, с кэшем ответов
+    для анонимных запросов"""
+    state = await CookingRecipe.objects.filter(pk=pk).amodification_state()
+    if not state['count']:
+        return json_response(
+            {'detail': 'No CookingRecipe matches the given query.'}, status=404
+        )
+
+    async def get_data():
+        if user.is_authenticated:
+            return await serialize_recipe(request, user, pk)
+        key = get_response_cache_key(
+            await aget_generation(), 'recipes', 'retrieve', request
+        )
+        data = await cache.aget(key)
+        if data is not None:
+            await aincrement_stat(HITS_KEY)
+            return data
+        await aincrement_stat(MISSES_KEY)
+        data = await serialize_recipe(request, user, pk)
+        await cache.aset(key, data, settings.API_CACHE_TIMEOUT)
+        return data
+
+    return await conditional_json(request, user, state, get_data)
+
+
+async def serialize_recipe(request, user, pk):
+    recipe = await (
+        CookingRecipe.objects
+        .defer('search_vector')
+        .select_related('creator')
+        .prefetch_related('recipe_components__component')
+        .with_user_flags(user)
+        .aget(pk=pk)
+    )
+    return CookingRecipeReadSerializer(recipe, context={'request': request}).data
+
+
+@async_read_view
+async def recipe_get_link(request, user, pk):
+    """Короткая ссылка на рецепт"""
+    code = await (
+        CookingRecipe.objects.filter(pk=pk)
+        .values_list('short_code', flat=True).afirst()
+    )
+    if code is None:
+        return json_response(
+            {'error': f'Рецепт с id={pk} не найден'}, status=404
+        )
+    return json_response({'short-link': request.build_absolute_uri(
+        reverse('short-link', kwargs={'code': code})
+    )})
@@ -0,0 +1,74 @@
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+
+# Счётчики меняются запросами UPDATE в обход объекта пользователя:
+# без них save() закэшированного пользователя не затрёт новые значения.
+# Хэш пароля не попадает в кэш: он нужен только для смены пароля
+# и тогда загружается отдельным запросом.
+DEFERRED_USER_FIELDS = (
+    'user__recipes_count', 'user__subscribers_count', 'user__subscriptions_count',
+    'user__password',
+)
+
+
+def get_token_cache_key(key):
+    return f'auth:token:{sha256(key.encode()).hexdigest()}'
+
+
+def invalidate_tokens(keys):
+    cache.delete_many([get_token_cache_key(key) for key in keys])
+
+
+def get_token_queryset(model):
+    return model.objects.select_related('user').defer(*DEFERRED_USER_FIELDS)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, берущая токен вместе с пользователем из кэша.
+
+    Запись удаляется сигналами при удалении токена (выход, удаление
+    пользователя) и при сохранении пользователя (смена пароля,
+    профиля, блокировка). Изменения в обход сигналов, например
+    QuerySet.update(), видны после AUTH_TOKEN_CACHE_TIMEOUT.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = get_token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            try:
+                token = get_token_queryset(self.get_model()).get(key=key)
+            except self.get_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            cache.set(cache_key, token, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return token.user, token
+
+    async def aauthenticate(self, request):
+        """authenticate для асинхронных представлений без DRF"""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        cache_key = get_token_cache_key(key)
+        token = await cache.aget(cache_key)
+        if token is None:
+            try:
+                token = await get_token_queryset(self.get_model()).aget(key=key)
+            except self.get_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            await cache.aset(cache_key, token, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return token.user, token
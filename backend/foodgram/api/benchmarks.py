@@ -0,0 +1,329 @@
+import asyncio
+import gc
+import importlib
+import json
+import random
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from statistics import quantiles
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import clear_url_caches
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.counters import reconcile_counters
+from recipes.models import (
+    CookingRecipe, FavoriteRecipe, ProductComponent, RecipeComponent,
+    ShoppingCart, User, UserSubscription
+)
+
+BASELINE_PATH = Path(__file__).with_name('benchmark_baseline.json')
+PLACEHOLDER_GIF = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04'
+    b'\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x01D\x00;'
+)
+
+# (имя, от чьего имени запрос, URL) — URL дополняются id из набора данных.
+ENDPOINTS = (
+    ('recipes-list', None, '/api/recipes/'),
+    ('recipes-list-auth', 'reader', '/api/recipes/'),
+    ('recipes-cursor', 'reader', '/api/recipes/?cursor='),
+    ('recipes-favorited', 'reader', '/api/recipes/?is_favorited=1'),
+    ('recipes-in-cart', 'reader', '/api/recipes/?is_in_shopping_cart=1'),
+    ('recipes-by-creator', 'reader', '/api/recipes/?creator={author}'),
+    ('recipes-search', None, '/api/recipes/?search=суп'),
+    ('recipes-popular', None, '/api/recipes/?ordering=-favorites_count'),
+    ('recipe-detail', None, '/api/recipes/{recipe}/'),
+    ('recipe-detail-auth', 'reader', '/api/recipes/{recipe}/'),
+    ('recipes-feed', 'reader', '/api/recipes/feed/'),
+    ('download-shopping-list', 'reader', '/api/recipes/download-shopping-list/'),
+    ('download-shopping-list-csv', 'reader', '/api/recipes/download-shopping-list/?format=csv'),
+    ('ingredients-list', None, '/api/ingredients/'),
+    ('ingredients-search', None, '/api/ingredients/?name=сал'),
+    ('ingredient-detail', None, '/api/ingredients/{product}/'),
+    ('users-list', 'reader', '/api/users/'),
+    ('user-detail', 'reader', '/api/users/{author}/'),
+    ('users-me', 'reader', '/api/users/me/'),
+    ('subscriptions', 'reader', '/api/users/subscriptions/?recipes_limit=3'),
+)
+
+# Эндпоинты с асинхронными версиями: (имя, от чьего имени, URL, статус).
+ASYNC_ENDPOINTS = (
+    ('ingredients-list', None, '/api/ingredients/', 200),
+    ('ingredients-search', None, '/api/ingredients/?name=сал', 200),
+    ('recipe-detail', None, '/api/recipes/{recipe}/', 200),
+    ('recipe-detail-auth', 'reader', '/api/recipes/{recipe}/', 200),
+    ('get-link', None, '/api/recipes/{recipe}/get-link/', 200),
+    ('short-link', None, '/s/{short_code}/', 302),
+)
+
+PRODUCT_WORDS = (
+    'салат', 'сахар', 'соль', 'мука', 'молоко', 'масло', 'морковь',
+    'картофель', 'капуста', 'свёкла', 'лук', 'чеснок', 'томат', 'рис',
+)
+RECIPE_WORDS = ('суп', 'салат', 'пирог', 'каша', 'рагу', 'запеканка')
+
+
+def build_dataset(users=30, recipes=150, products=120, components=6, seed=0):
+    """Создаёт воспроизводимый набор данных через ORM.
+
+    Рецепты и подписки создаются по одному, чтобы сработали сигналы
+    (ленты, поисковые векторы, копии изображений), остальное —
+    bulk_create с пересчётом счётчиков в конце.
+    """
+    rng = random.Random(seed)
+    product_objects = ProductComponent.objects.bulk_create(
+        ProductComponent(
+            title=f'{PRODUCT_WORDS[index % len(PRODUCT_WORDS)]} {index}',
+            unit_type=rng.choice(('г', 'мл', 'шт'))
+        )
+        for index in range(products)
+    )
+    user_objects = [
+        User.objects.create_user(
+            email=f'bench{index}@foodgram.ru', username=f'bench{index}',
+            first_name='Иван', last_name=f'Бенчмарков {index}'
+        )
+        for index in range(users)
+    ]
+    reader, authors = user_objects[0], user_objects[1:]
+    recipe_objects = []
+    for index in range(recipes):
+        recipe = CookingRecipe.objects.create(
+            creator=rng.choice(authors),
+            title=f'{rng.choice(RECIPE_WORDS)} {index}',
+            description='Нарезать, смешать и варить до готовности.',
+            cook_duration=rng.randint(5, 120),
+            picture=ContentFile(PLACEHOLDER_GIF, name='recipe.gif')
+        )
+        RecipeComponent.objects.bulk_create(
+            RecipeComponent(recipe=recipe, component=product, quantity=rng.randint(1, 500))
+            for product in rng.sample(product_objects, components)
+        )
+        recipe_objects.append(recipe)
+    for subscriber in user_objects:
+        for author in rng.sample(authors, min(len(authors), 5)):
+            if author != subscriber:
+                UserSubscription.objects.create(subscriber=subscriber, target_user=author)
+    for model in (FavoriteRecipe, ShoppingCart):
+        model.objects.bulk_create(
+            (
+                model(user=user, recipe=recipe)
+                for user in user_objects
+                for recipe in rng.sample(recipe_objects, min(len(recipe_objects), 10))
+            ),
+            ignore_conflicts=True
+        )
+    reconcile_counters()
+    CookingRecipe.objects.update_search_vector()
+    author = UserSubscription.objects.filter(subscriber=reader).first().target_user
+    return {
+        'reader': reader,
+        'author': author.pk,
+        'recipe': recipe_objects[0].pk,
+        'short_code': recipe_objects[0].short_code,
+        'product': product_objects[0].pk,
+    }
+
+
+def percentile(samples, percent):
+    if len(samples) == 1:
+        return samples[0]
+    return quantiles(samples, n=100, method='inclusive')[percent - 1]
+
+
+def measure(dataset, iterations=30, warmup=3, names=None):
+    """Время ответа (мс) и число SQL-запросов для каждого эндпоинта.
+
+    Эндпоинты опрашиваются по кругу, чтобы кратковременные помехи
+    распределялись между ними, а не искажали p95 одного. Перед каждым
+    запросом кэш очищается, чтобы измерялась работа с базой, а не
+    попадания в кэш ответов; сборщик мусора на время запроса
+    отключается, как в timeit.
+    """
+    endpoints = []
+    for name, user, url in ENDPOINTS:
+        if names and name not in names:
+            continue
+        client = APIClient()
+        if user:
+            client.force_authenticate(dataset[user])
+        endpoints.append((name, client, url.format(**dataset)))
+    timings = {name: [] for name, _, _ in endpoints}
+    queries = dict.fromkeys(timings, 0)
+    for iteration in range(warmup + iterations):
+        for name, client, url in endpoints:
+            cache.clear()
+            gc.collect()
+            gc.disable()
+            try:
+                with CaptureQueriesContext(connection) as context:
+                    started = perf_counter()
+                    response = client.get(url)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    elapsed = (perf_counter() - started) * 1000
+            finally:
+                gc.enable()
+            if response.status_code != 200:
+                raise AssertionError(f'{name}: {url} вернул {response.status_code}')
+            if iteration >= warmup:
+                timings[name].append(elapsed)
+                queries[name] = max(queries[name], len(context.captured_queries))
+    return {
+        name: {
+            'queries': queries[name],
+            'p50': round(percentile(samples, 50), 2),
+            'p95': round(percentile(samples, 95), 2),
+            'p99': round(percentile(samples, 99), 2),
+        }
+        for name, samples in timings.items()
+    }
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'queries': {}, 'p95': {}}
+
+
+def save_baseline(results, vendor, path=BASELINE_PATH):
+    """Сохраняет бюджеты запросов и p95 текущей СУБД"""
+    baseline = load_baseline(path)
+    baseline['queries'].update(
+        (name, result['queries']) for name, result in results.items()
+    )
+    baseline['p95'].setdefault(vendor, {}).update(
+        (name, result['p95']) for name, result in results.items()
+    )
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(baseline, file, ensure_ascii=False, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def compare(results, baseline, vendor, threshold=0.5, slack=2.0):
+    """Список нарушений: превышение бюджета запросов или рост p95
+    больше чем на threshold (и больше чем на slack мс)"""
+    failures = []
+    latency = baseline['p95'].get(vendor, {})
+    for name, result in results.items():
+        budget = baseline['queries'].get(name)
+        if budget is not None and result['queries'] > budget:
+            failures.append(
+                f'{name}: {result["queries"]} SQL-запросов при бюджете {budget}'
+            )
+        p95 = latency.get(name)
+        if p95 is not None and result['p95'] > max(p95 * (1 + threshold), p95 + slack):
+            failures.append(
+                f'{name}: p95 {result["p95"]} мс при базовом {p95} мс'
+            )
+    return failures
+
+
+@contextmanager
+def views_mode(async_views):
+    """Подключает асинхронные или синхронные представления чтения,
+    перечитывая URLconf с другим значением ASYNC_VIEWS"""
+    def reload_urls():
+        for module in ('api.urls', 'recipes.urls', settings.ROOT_URLCONF):
+            importlib.reload(importlib.import_module(module))
+        clear_url_caches()
+
+    try:
+        with override_settings(ASYNC_VIEWS=async_views):
+            reload_urls()
+            yield
+    finally:
+        reload_urls()
+
+
+async def asgi_get(application, url, headers=()):
+    """GET через ASGI-приложение, возвращает статус ответа"""
+    parts = urlsplit(url)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': parts.path,
+        'raw_path': parts.path.encode(), 'query_string': parts.query.encode(),
+        'headers': [(b'host', b'testserver'), *headers],
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+    }
+    received = False
+    status = None
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Клиент не отключается, ожидание отменит обработчик.
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+async def measure_concurrent_endpoint(application, url, headers, status,
+                                      concurrency, rounds):
+    timings = []
+    peak_threads = threading.active_count()
+
+    async def timed_get():
+        nonlocal peak_threads
+        started = perf_counter()
+        response_status = await asgi_get(application, url, headers)
+        timings.append((perf_counter() - started) * 1000)
+        peak_threads = max(peak_threads, threading.active_count())
+        if response_status != status:
+            raise AssertionError(f'{url} вернул {response_status}')
+
+    started = perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*(timed_get() for _ in range(concurrency)))
+    elapsed = perf_counter() - started
+    return {
+        'rps': round(len(timings) / elapsed, 1),
+        'p50': round(percentile(timings, 50), 2),
+        'p95': round(percentile(timings, 95), 2),
+        'threads': peak_threads,
+    }
+
+
+def measure_concurrent(dataset, concurrency=50, rounds=10, names=None):
+    """Пропускная способность, задержка и пиковое число потоков
+    синхронных и асинхронных версий эндпоинтов под ASGI.
+
+    Каждый раунд — concurrency одновременных запросов в одном цикле
+    событий, как у одного воркера uvicorn.
+    """
+    token = Token.objects.get_or_create(user=dataset['reader'])[0]
+    results = {}
+    for mode, async_views in (('sync', False), ('async', True)):
+        with views_mode(async_views):
+            application = get_asgi_application()
+            for name, user, url, status in ASYNC_ENDPOINTS:
+                if names and name not in names:
+                    continue
+                headers = [(b'authorization', f'Token {token.key}'.encode())] if user else []
+                results.setdefault(name, {})[mode] = asyncio.run(
+                    measure_concurrent_endpoint(
+                        application, url.format(**dataset), headers, status,
+                        concurrency, rounds
+                    )
+                )
+    return results
@@ -0,0 +1,108 @@
+from hashlib import md5
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+GENERATION_KEY = 'api:generation'
+HITS_KEY = 'api:stats:hits'
+MISSES_KEY = 'api:stats:misses'
+
+
+def get_generation():
+    """Текущее поколение кэша ответов.
+
+    Если ключ поколения вытеснен из кэша, начинаем с метки времени,
+    чтобы не вернуться к номеру, под которым лежат устаревшие ответы.
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, int(time() * 1000), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+async def aget_generation():
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(GENERATION_KEY, int(time() * 1000), timeout=None)
+        generation = await cache.aget(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    """Делает недействительными все закэшированные ответы"""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        get_generation()
+
+
+def increment_stat(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+async def aincrement_stat(key):
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aadd(key, 1, timeout=None)
+
+
+def get_response_cache_key(generation, basename, action, request):
+    # В ответе абсолютные URL картинок и страниц: схема и хост
+    # входят в ключ вместе с путём.
+    uri = md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'api:response:{generation}:{basename}:{action}:{uri}'
+
+
+def get_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'generation': get_generation(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+class AnonymousCacheMixin:
+    """Кэширует данные ответов list/retrieve для анонимных запросов.
+
+    Ключ содержит номер поколения, который увеличивается при любой
+    записи рецептов, продуктов, профилей, избранного и корзин,
+    поэтому инвалидация точная.
+    """
+
+    cached_actions = ('list', 'retrieve')
+
+    def get_cache_key(self, request):
+        return get_response_cache_key(
+            get_generation(), self.basename, self.action, request
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if self.action not in self.cached_actions or request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            increment_stat(HITS_KEY)
+            return Response(data)
+        increment_stat(MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.API_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,143 @@
+from datetime import datetime
+from hashlib import sha256
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from recipes.models import FavoriteRecipe, ShoppingCart, User, UserSubscription
+from .cache import get_generation
+
+USER_RELATIONS = (
+    (FavoriteRecipe, 'user'),
+    (ShoppingCart, 'user'),
+    (UserSubscription, 'subscriber'),
+)
+
+
+def relation_state(model, field):
+    """Число строк пользователя и их наибольший id.
+
+    В избранное, корзину и подписки строки только добавляются
+    и удаляются, поэтому эта пара меняется при любом изменении.
+    """
+    rows = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+    return (
+        Subquery(rows.annotate(value=Count('pk')).values('value')),
+        Subquery(rows.annotate(value=Max('pk')).values('value')),
+    )
+
+
+def user_state_queryset(user):
+    return User.objects.filter(pk=user.pk).values_list(*(
+        expression
+        for model, field in USER_RELATIONS
+        for expression in relation_state(model, field)
+    ))
+
+
+def get_user_state(user):
+    """Состояние избранного, корзины и подписок пользователя одним запросом"""
+    if not user.is_authenticated:
+        return ()
+    return user_state_queryset(user).first()
+
+
+async def aget_user_state(user):
+    if not user.is_authenticated:
+        return ()
+    return await user_state_queryset(user).afirst()
+
+
+def build_validators(request, renderer_format, user, state, user_state,
+                     use_last_modified=True):
+    """ETag и Last-Modified по состоянию данных, пути запроса,
+    формату ответа и состоянию пользователя"""
+    parts = (
+        request.get_full_path(),
+        renderer_format,
+        user.pk,
+        sorted(state.items()),
+        user_state,
+    )
+    etag = quote_etag(sha256(repr(parts).encode()).hexdigest())
+    last_modified = None
+    if use_last_modified and not user.is_authenticated:
+        timestamps = [
+            value.timestamp() for value in state.values()
+            if isinstance(value, datetime)
+        ]
+        last_modified = int(max(timestamps)) if timestamps else None
+    return etag, last_modified
+
+
+def conditional_headers(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+class ConditionalGetMixin:
+    """Отвечает 304 на list/retrieve, если данные не изменились.
+
+    Представление возвращает из ``get_modification_state`` словарь
+    с состоянием данных: для объекта — число строк и время изменения,
+    для списков — поколение кэша ответов (``list_state``), которое
+    сигналы увеличивают при каждой записи, без агрегата по таблице.
+    Из него, пути запроса и состояния избранного, корзины и подписок
+    пользователя строится строгий ETag. Last-Modified отдаётся только
+    анонимным запросам объекта: у флагов пользователя нет времени
+    изменения, а время списка не меняется при удалении строк.
+    """
+
+    conditional_actions = ('list', 'retrieve')
+    last_modified_actions = ('retrieve',)
+
+    def list_state(self):
+        return {'generation': get_generation()}
+
+    def get_modification_state(self, request):
+        raise NotImplementedError
+
+    def filter_lookup(self, queryset):
+        """Queryset объекта из URL; пустой, если значение не подходит к полю"""
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            return queryset.filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        except (TypeError, ValueError, ValidationError):
+            return queryset.none()
+
+    def get_validators(self, request):
+        state = self.get_modification_state(request)
+        if state is None:
+            return None, None
+        return build_validators(
+            request, request.accepted_renderer.format, request.user,
+            state, get_user_state(request.user),
+            use_last_modified=self.action in self.last_modified_actions
+        )
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        if self.action not in self.conditional_actions:
+            return handler(request, *args, **kwargs)
+        etag, last_modified = self.get_validators(request)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        return conditional_headers(response, etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
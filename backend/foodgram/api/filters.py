@@ -1,11 +1,24 @@
-from recipes.models import CookingRecipe
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Exists, F, OuterRef
+from rest_framework.filters import SearchFilter
+
+from recipes.component_index import component_index
+from recipes.models import CookingRecipe, RecipeComponent, SEARCH_CONFIG
 from django_filters import rest_framework as filters
 
 
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
+
+
 class CookingRecipeFilter(filters.FilterSet):
     
     is_favorited = filters.BooleanFilter(method='filter_favorited')
     is_in_shopping_cart = filters.BooleanFilter(method='filter_in_cart')
+    ingredients = NumberInFilter(method='filter_ingredients')
+    exclude_ingredients = NumberInFilter(method='filter_exclude_ingredients')
 
     class Meta:
         model = CookingRecipe
@@ -13,10 +26,65 @@ class CookingRecipeFilter(filters.FilterSet):
 
     def filter_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favorite_recipes__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def filter_in_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(shopping_items__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
+
+    def filter_ingredients(self, queryset, name, value):
+        """Рецепты со всеми продуктами ?ingredients=1,2 и без продуктов
+        ?exclude_ingredients=3 по обратному индексу. Если рецептов больше
+        COMPONENT_FILTER_LIMIT, условия проверяет БД: подходящих много,
+        и страница по дате набирается быстро без длинного списка id."""
+        if not value:
+            return queryset
+        excluded = self.form.cleaned_data.get('exclude_ingredients') or ()
+        recipe_ids = component_index.recipes_with_all(
+            map(int, value), map(int, excluded), settings.COMPONENT_FILTER_LIMIT
+        )
+        if recipe_ids is not None:
+            return queryset.filter(pk__in=recipe_ids)
+        for component in value:
+            queryset = queryset.filter(Exists(RecipeComponent.objects.filter(
+                recipe=OuterRef('pk'), component=component
+            )))
+        return self.exclude_components(queryset, excluded)
+
+    def filter_exclude_ingredients(self, queryset, name, value):
+        if not value or self.form.cleaned_data.get('ingredients'):
+            return queryset
+        return self.exclude_components(queryset, value)
+
+    def exclude_components(self, queryset, components):
+        """Рецептов без продуктов обычно почти вся таблица, поэтому
+        исключение без ?ingredients= выполняет БД антисоединением"""
+        if not components:
+            return queryset
+        return queryset.filter(~Exists(RecipeComponent.objects.filter(
+            recipe=OuterRef('pk'), component__in=components
+        )))
+
+
+class RecipeSearchFilter(SearchFilter):
+    """Полнотекстовый поиск рецептов по ?search= с ранжированием.
+
+    На PostgreSQL ищет по поисковому вектору рецепта (название,
+    описание, продукты), на других СУБД использует search_fields.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = request.query_params.get(self.search_param, '').strip()
+        if not search_terms or connection.vendor != 'postgresql':
+            return super().filter_queryset(request, queryset, view)
+        query = SearchQuery(
+            search_terms, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return (
+            queryset
+            .filter(search_vector=query)
+            .annotate(search_rank=SearchRank(F('search_vector'), query))
+            .order_by('-search_rank', *CookingRecipe._meta.ordering)
+        )
@@ -0,0 +1,71 @@
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment
+)
+from django.utils.translation import gettext_lazy as _
+from api.benchmarks import (
+    build_dataset, compare, load_baseline, measure, save_baseline
+)
+
+
+class Command(BaseCommand):
+    help = _(
+        'Измеряет время ответа и число SQL-запросов эндпоинтов API '
+        'на тестовой базе и сравнивает с базовыми значениями'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30,
+                            help=_('Число измерений каждого эндпоинта'))
+        parser.add_argument('--warmup', type=int, default=3,
+                            help=_('Число прогревочных запросов'))
+        parser.add_argument('--threshold', type=float, default=0.5,
+                            help=_('Допустимый относительный рост p95'))
+        parser.add_argument('--users', type=int, default=30)
+        parser.add_argument('--recipes', type=int, default=150)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help=_('Измерить только указанные эндпоинты'))
+        parser.add_argument('--update-baseline', action='store_true',
+                            help=_('Записать результаты как базовые; число '
+                                   'запросов сначала сверьте на разных '
+                                   '--users и --recipes'))
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            with tempfile.TemporaryDirectory() as media_root, \
+                    override_settings(MEDIA_ROOT=media_root):
+                dataset = build_dataset(
+                    users=options['users'], recipes=options['recipes'],
+                    seed=options['seed']
+                )
+                results = measure(
+                    dataset, options['iterations'], options['warmup'],
+                    options['endpoints']
+                )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f'{"эндпоинт":<28} {"запросы":>8} {"p50":>8} {"p95":>8} {"p99":>8}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<28} {result["queries"]:>8} {result["p50"]:>8} '
+                f'{result["p95"]:>8} {result["p99"]:>8}'
+            )
+
+        vendor = connection.vendor
+        if options['update_baseline']:
+            save_baseline(results, vendor)
+            self.stdout.write(self.style.SUCCESS(_('Базовые значения обновлены')))
+            return
+        failures = compare(results, load_baseline(), vendor, options['threshold'])
+        if failures:
+            raise CommandError('\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS(_('Бюджеты производительности соблюдены')))
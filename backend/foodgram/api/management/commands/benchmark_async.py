@@ -0,0 +1,56 @@
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment
+)
+from django.utils.translation import gettext_lazy as _
+from api.benchmarks import build_dataset, measure_concurrent
+
+
+class Command(BaseCommand):
+    help = _(
+        'Сравнивает синхронные и асинхронные версии частых запросов '
+        'на чтение под ASGI при одновременных запросах'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help=_('Число одновременных запросов'))
+        parser.add_argument('--rounds', type=int, default=10,
+                            help=_('Число раундов одновременных запросов'))
+        parser.add_argument('--users', type=int, default=30)
+        parser.add_argument('--recipes', type=int, default=150)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help=_('Измерить только указанные эндпоинты'))
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            with tempfile.TemporaryDirectory() as media_root, \
+                    override_settings(MEDIA_ROOT=media_root):
+                dataset = build_dataset(
+                    users=options['users'], recipes=options['recipes'],
+                    seed=options['seed']
+                )
+                results = measure_concurrent(
+                    dataset, options['concurrency'], options['rounds'],
+                    options['endpoints']
+                )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f'{"эндпоинт":<22} {"режим":<6} {"запр/с":>8} {"p50":>8} '
+            f'{"p95":>8} {"потоки":>7}'
+        )
+        for name, modes in results.items():
+            for mode, result in modes.items():
+                self.stdout.write(
+                    f'{name:<22} {mode:<6} {result["rps"]:>8} {result["p50"]:>8} '
+                    f'{result["p95"]:>8} {result["threads"]:>7}'
+                )
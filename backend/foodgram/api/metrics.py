@@ -0,0 +1,285 @@
+from bisect import bisect_left
+from hmac import compare_digest
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from threading import Lock
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Гистограмма в памяти процесса с метками view и method"""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self._lock = Lock()
+        self._values = {}
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # Счётчики корзин, +Inf, затем сумма и число наблюдений.
+                counts = self._values[labels] = [0] * (len(self.buckets) + 3)
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for (view, method), counts in sorted(values.items()):
+            labels = f'view="{view}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f'{self.name}_sum{{{labels}}} {counts[-2]}'
+            yield f'{self.name}_count{{{labels}}} {counts[-1]}'
+
+
+class Counter:
+    """Счётчик в памяти процесса"""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        yield f'{self.name} {self.value}'
+
+
+# Показатели psycopg_pool.ConnectionPool.get_stats(): (имя, тип, описание).
+POOL_STATS = (
+    ('pool_min', 'gauge', 'Минимальный размер пула.'),
+    ('pool_max', 'gauge', 'Максимальный размер пула.'),
+    ('pool_size', 'gauge', 'Соединений в пуле, включая выданные.'),
+    ('pool_available', 'gauge', 'Свободных соединений в пуле.'),
+    ('requests_waiting', 'gauge', 'Запросов соединения в очереди.'),
+    ('requests_num', 'counter', 'Всего запросов соединения.'),
+    ('requests_queued', 'counter', 'Запросов, ожидавших соединения.'),
+    ('requests_wait_ms', 'counter', 'Суммарное ожидание соединения, мс.'),
+    ('requests_errors', 'counter', 'Запросов, не получивших соединения.'),
+    ('usage_ms', 'counter', 'Суммарное время использования соединений, мс.'),
+    ('connections_num', 'counter', 'Открытых пулом соединений.'),
+    ('connections_errors', 'counter', 'Ошибок открытия соединений.'),
+    ('connections_lost', 'counter', 'Соединений, не прошедших проверку.'),
+)
+
+
+def render_pool_stats():
+    """Заполненность и ожидание пула соединений каждой базы с пулом"""
+    pools = {
+        alias: pool for alias in connections
+        if (pool := getattr(connections[alias], 'pool', None)) is not None
+    }
+    if not pools:
+        return
+    stats = {alias: pool.get_stats() for alias, pool in pools.items()}
+    for key, kind, documentation in POOL_STATS:
+        name = f'foodgram_db_{key}'
+        if kind == 'counter':
+            name += '_total'
+        yield f'# HELP {name} {documentation}'
+        yield f'# TYPE {name} {kind}'
+        for alias, values in stats.items():
+            yield f'{name}{{alias="{alias}"}} {values.get(key, 0)}'
+
+
+CONNECTIONS_OPENED = Counter(
+    'foodgram_db_connections_opened_total',
+    'Открытых процессом соединений с базой.'
+)
+REQUEST_DURATION = Histogram(
+    'foodgram_request_duration_seconds', 'Время обработки запроса.', DURATION_BUCKETS
+)
+DB_DURATION = Histogram(
+    'foodgram_db_duration_seconds', 'Время SQL-запросов за запрос.', DURATION_BUCKETS
+)
+DB_QUERIES = Histogram(
+    'foodgram_db_queries', 'Число SQL-запросов за запрос.', QUERY_BUCKETS
+)
+RENDER_DURATION = Histogram(
+    'foodgram_render_duration_seconds', 'Время рендеринга ответа.', DURATION_BUCKETS
+)
+HISTOGRAMS = (REQUEST_DURATION, DB_DURATION, DB_QUERIES, RENDER_DURATION)
+
+
+def render_metrics():
+    return '\n'.join((
+        *(line for histogram in HISTOGRAMS for line in histogram.render()),
+        *CONNECTIONS_OPENED.render(),
+        *render_pool_stats(),
+    )) + '\n'
+
+
+def get_view_name(request):
+    """CookingRecipeViewSet.list для viewset'ов, имя класса или функции
+    для остальных представлений"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view_func = match.func
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    action = (getattr(view_func, 'actions', None) or {}).get(request.method.lower())
+    return f'{view_class.__name__}.{action}' if action else view_class.__name__
+
+
+_query_observers = ContextVar('query_observers', default=())
+
+
+def run_query_observers(execute, sql, params, many, context):
+    """Обёртка execute_wrapper каждого соединения, передающая запрос
+    наблюдателям текущего контекста.
+
+    Контекст копируется в потоки sync_to_async, поэтому наблюдатели
+    видят и запросы асинхронного ORM, выполняемые в другом потоке
+    с другим соединением.
+    """
+    for observer in _query_observers.get():
+        execute = partial(observer, execute)
+    return execute(sql, params, many, context)
+
+
+def install_query_observers(connection):
+    if run_query_observers not in connection.execute_wrappers:
+        connection.execute_wrappers.append(run_query_observers)
+
+
+@contextmanager
+def observe_queries(observer):
+    """Передаёт observer, как обёртке execute_wrapper, все SQL-запросы
+    блока, в том числе выполненные через sync_to_async"""
+    token = _query_observers.set((*_query_observers.get(), observer))
+    try:
+        yield observer
+    finally:
+        _query_observers.reset(token)
+
+
+class QueryTimer:
+    """Наблюдатель observe_queries: число и время SQL-запросов"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - started
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """Считает время запроса, SQL-запросы и рендеринг для каждого
+    представления, пишет их в заголовок Server-Timing и в гистограммы
+    для /metrics.
+
+    Время представления без SQL (app) включает работу сериализаторов:
+    в DRF они выполняются внутри действия. Рендеринг ответа в байты
+    измеряется отдельно. Запросы потоковых ответов, выполняемые после
+    возврата из представления, не учитываются. Гистограммы хранятся
+    в памяти процесса: каждый воркер отдаёт свои.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'SERVER_TIMING_ENABLED', settings.DEBUG)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # Синхронный обработчик Django вызывал бы через sync_to_async.
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = perf_counter()
+        request._metrics_render = 0.0
+        with observe_queries(QueryTimer()) as timer:
+            response = self.get_response(request)
+        return self.record(request, response, started, timer)
+
+    async def __acall__(self, request):
+        started = perf_counter()
+        request._metrics_render = 0.0
+        with observe_queries(QueryTimer()) as timer:
+            response = await self.get_response(request)
+        return self.record(request, response, started, timer)
+
+    def record(self, request, response, started, timer):
+        total = perf_counter() - started
+        labels = (get_view_name(request), request.method)
+        REQUEST_DURATION.observe(labels, total)
+        DB_DURATION.observe(labels, timer.duration)
+        DB_QUERIES.observe(labels, timer.count)
+        RENDER_DURATION.observe(labels, request._metrics_render)
+        if self.server_timing:
+            app = max(total - timer.duration - request._metrics_render, 0)
+            response['Server-Timing'] = ', '.join((
+                f'db;dur={timer.duration * 1000:.1f};desc="{timer.count} queries"',
+                f'app;dur={app * 1000:.1f}',
+                f'render;dur={request._metrics_render * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            ))
+        return response
+
+    def process_template_response(self, request, response):
+        started = perf_counter()
+
+        def finish_render(response):
+            request._metrics_render = perf_counter() - started
+
+        response.add_post_render_callback(finish_render)
+        return response
+
+    async def aprocess_template_response(self, request, response):
+        return MetricsMiddleware.process_template_response(self, request, response)
+
+
+def has_metrics_access(request):
+    """Персонал или сборщик метрик с токеном METRICS_TOKEN"""
+    if request.user.is_staff:
+        return True
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    keyword, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    return bool(token) and keyword == 'Bearer' and compare_digest(
+        credentials.encode(), token.encode()
+    )
+
+
+def metrics(request):
+    """Гистограммы процесса в текстовом формате Prometheus"""
+    if not has_metrics_access(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
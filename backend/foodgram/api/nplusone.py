@@ -0,0 +1,142 @@
+import logging
+import re
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.test.utils import override_settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+IN_LIST = re.compile(r'\bIN \((?:%s, )*%s\)')
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+# Обёртки SQL не считаются местом выполнения запроса.
+INSTRUMENTATION_FILES = {__file__, metrics.__file__}
+
+
+class NPlusOneError(Exception):
+    """Одинаковый SQL-запрос повторён больше допустимого числа раз"""
+
+
+def fingerprint(sql):
+    """SQL без значений: запросы, различающиеся только параметрами,
+    длиной списков IN и числами в тексте, совпадают"""
+    return LITERALS.sub('?', IN_LIST.sub('IN (...)', sql))
+
+
+def get_caller():
+    """Ближайший к запросу кадр кода проекта, файл:строка функция"""
+    project = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if (
+            frame.filename.startswith(project)
+            and 'site-packages' not in frame.filename
+            and frame.filename not in INSTRUMENTATION_FILES
+        ):
+            return f'{frame.filename[len(project) + 1:]}:{frame.lineno} {frame.name}'
+    return 'unknown'
+
+
+class QueryRecorder:
+    """Наблюдатель observe_queries: число выполнений каждого
+    отпечатка SQL и место в коде, откуда он выполнялся"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.callers = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        key = fingerprint(sql)
+        self.counts[key] += 1
+        if self.counts[key] == 2:
+            # Место берётся со второго выполнения: первое нередко
+            # делает код, которому повтор не свойственен.
+            self.callers[key] = get_caller()
+        return execute(sql, params, many, context)
+
+    def offenders(self, threshold):
+        return [
+            (sql, count, self.callers[sql])
+            for sql, count in self.counts.most_common()
+            if count > threshold
+        ]
+
+
+def format_offenders(offenders, label=''):
+    return '\n'.join(
+        f'N+1{label}: {count} одинаковых запросов из {caller}: {sql}'
+        for sql, count, caller in offenders
+    )
+
+
+@contextmanager
+def detect_nplusone(threshold=None, label=''):
+    """Выполняет блок с записью SQL и сообщает о повторяющихся запросах:
+    пишет предупреждение в лог или бросает NPlusOneError, если включён
+    NPLUSONE_RAISE"""
+    threshold = threshold or settings.NPLUSONE_THRESHOLD
+    recorder = QueryRecorder()
+    with metrics.observe_queries(recorder):
+        yield recorder
+    offenders = recorder.offenders(threshold)
+    if not offenders:
+        return
+    message = format_offenders(offenders, label)
+    if settings.NPLUSONE_RAISE:
+        raise NPlusOneError(message)
+    logger.warning(message)
+
+
+class NPlusOneMiddleware:
+    """Ищет N+1 в каждом запросе, если включён NPLUSONE_ENABLED"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.NPLUSONE_ENABLED:
+            return self.get_response(request)
+        with detect_nplusone(label=f' в {request.method} {request.path}'):
+            response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.NPLUSONE_ENABLED:
+            return await self.get_response(request)
+        with detect_nplusone(label=f' в {request.method} {request.path}'):
+            response = await self.get_response(request)
+        return response
+
+
+class NPlusOneTestMixin:
+    """Включает детектор N+1 с исключением для всех запросов
+    тестового клиента"""
+
+    nplusone_threshold = 2
+
+    def setUp(self):
+        super().setUp()
+        override = override_settings(
+            NPLUSONE_ENABLED=True, NPLUSONE_RAISE=True,
+            NPLUSONE_THRESHOLD=self.nplusone_threshold
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    @contextmanager
+    def assertNoNPlusOne(self, threshold=None):
+        """Проверяет на N+1 код вне запросов тестового клиента"""
+        with detect_nplusone(threshold or self.nplusone_threshold):
+            yield
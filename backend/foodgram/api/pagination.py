@@ -0,0 +1,103 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from recipes.feed import get_feed_page
+
+
+class RecipePagination(LimitOffsetPagination):
+    """Limit/offset-пагинация ленты рецептов с keyset-режимом по ?cursor=.
+
+    В keyset-режиме страница выбирается условием по паре
+    (date_created, id) вместо OFFSET, а запрос COUNT(*) не выполняется.
+    """
+
+    cursor_query_param = 'cursor'
+    cursor_ordering = ('-date_created', '-id')
+    invalid_cursor_message = _('Некорректный курсор')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.cursor_query_param in request.query_params
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        queryset = queryset.order_by(*self.cursor_ordering)
+        position = self.decode_cursor(
+            request.query_params[self.cursor_query_param]
+        )
+        if position is not None:
+            date_created, pk = position
+            queryset = queryset.filter(
+                Q(date_created__lt=date_created)
+                | Q(date_created=date_created, pk__lt=pk)
+            )
+
+        page = list(queryset[:self.limit + 1])
+        self.next_position = None
+        if len(page) > self.limit:
+            page = page[:self.limit]
+            self.next_position = (page[-1].date_created, page[-1].pk)
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_cursor_link(),
+            'results': data,
+        })
+
+    def get_next_cursor_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(
+            url, self.cursor_query_param,
+            self.encode_cursor(*self.next_position)
+        )
+
+    def encode_cursor(self, date_created, pk):
+        value = f'{date_created.isoformat()}|{pk}'
+        return urlsafe_b64encode(value.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            value = urlsafe_b64decode(cursor.encode()).decode()
+            date_created, pk = value.split('|')
+            return datetime.fromisoformat(date_created), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class FeedPagination(RecipePagination):
+    """Курсорная пагинация ленты подписок.
+
+    Страница собирается из позиций записей ленты и рецептов
+    знаменитостей, без OFFSET и COUNT(*).
+    """
+
+    def paginate_feed(self, user, request):
+        """Возвращает id рецептов страницы в порядке ленты"""
+        self.use_cursor = True
+        self.request = request
+        self.limit = self.get_limit(request)
+        position = self.decode_cursor(
+            request.query_params.get(self.cursor_query_param)
+        )
+        positions = get_feed_page(user, position, self.limit + 1)
+        self.next_position = None
+        if len(positions) > self.limit:
+            positions = positions[:self.limit]
+            self.next_position = positions[-1]
+        return [pk for _, pk in positions]
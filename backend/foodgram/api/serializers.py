@@ -4,21 +4,51 @@ from djoser.serializers import UserSerializer as DjoserUserSerializer
 
 from recipes.models import CookingRecipe, ProductComponent, RecipeComponent, FavoriteRecipe, ShoppingCart
 from recipes.models import User, UserSubscription
+from recipes.component_index import component_index
+from recipes.counters import shift_counter
+from recipes.images import AVATAR_SIZES, RECIPE_PICTURE_SIZES, derivative_urls
+
+BULK_RECIPES_LIMIT = 100
+COOKABLE_INGREDIENTS_LIMIT = 100
+
+
+def build_image_url(image, request=None):
+    """Абсолютный URL изображения, как его отдаёт ``ImageField``"""
+    if not image:
+        return None
+    if request is not None:
+        return request.build_absolute_uri(image.url)
+    return image.url
+
+
+class ImageDerivativesField(serializers.Field):
+    """URL уменьшенных копий изображения в WebP и JPEG"""
+
+    def __init__(self, sizes, **kwargs):
+        self.sizes = sizes
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, image):
+        return derivative_urls(image, self.sizes, self.context.get('request'))
 
 
 class UserSerializer(DjoserUserSerializer):
 
     is_subscribed = serializers.SerializerMethodField(read_only=True)
     avatar = Base64ImageField(required=False, allow_null=True)
+    avatar_thumbnails = ImageDerivativesField(AVATAR_SIZES, source='avatar')
 
     class Meta(DjoserUserSerializer.Meta):
         model = User
         fields = DjoserUserSerializer.Meta.fields + (
-            'is_subscribed', 'avatar'
+            'is_subscribed', 'avatar', 'avatar_thumbnails'
         )
         read_only_fields = fields
 
     def get_is_subscribed(self, user):
+        if hasattr(user, 'is_subscribed'):
+            return user.is_subscribed
         request = self.context.get('request')
         return (
             request and request.user.is_authenticated and 
@@ -61,6 +91,9 @@ class CookingRecipeSerializer(serializers.ModelSerializer):
     
     creator = UserSerializer(read_only=True)
     picture = Base64ImageField(required=True)
+    picture_thumbnails = ImageDerivativesField(
+        RECIPE_PICTURE_SIZES, source='picture'
+    )
     components = ComponentInputSerializer(many=True, write_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
@@ -69,8 +102,9 @@ class CookingRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = CookingRecipe
         fields = (
-            'id', 'creator', 'title', 'description', 'picture', 'cook_duration',
-            'components', 'is_favorited', 'is_in_shopping_cart'
+            'id', 'creator', 'title', 'description', 'picture',
+            'picture_thumbnails', 'cook_duration', 'components',
+            'is_favorited', 'is_in_shopping_cart'
         )
         read_only_fields = ('creator', 'is_favorited', 'is_in_shopping_cart')
 
@@ -82,17 +116,18 @@ class CookingRecipeSerializer(serializers.ModelSerializer):
         return representation
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        return (
-            user and user.is_authenticated and 
-            FavoriteRecipe.objects.filter(user=user, recipe=obj).exists()
-        )
+        return self._get_user_flag(obj, 'is_favorited', FavoriteRecipe)
 
     def get_is_in_shopping_cart(self, obj):
+        return self._get_user_flag(obj, 'is_in_shopping_cart', ShoppingCart)
+
+    def _get_user_flag(self, recipe, flag, model_class):
+        if hasattr(recipe, flag):
+            return getattr(recipe, flag)
         user = self.context.get('request').user
         return (
             user and user.is_authenticated and 
-            ShoppingCart.objects.filter(user=user, recipe=obj).exists()
+            model_class.objects.filter(user=user, recipe=recipe).exists()
         )
 
     def validate_components(self, components_list):
@@ -113,6 +148,7 @@ class CookingRecipeSerializer(serializers.ModelSerializer):
         components = validated_data.pop('components')
         recipe = super().create(validated_data)
         self._create_recipe_components(recipe, components)
+        CookingRecipe.objects.filter(pk=recipe.pk).update_search_vector()
         return recipe
 
     def update(self, instance, validated_data):
@@ -131,37 +167,112 @@ class CookingRecipeSerializer(serializers.ModelSerializer):
             )
             for component_data in components
         ])
+        component_ids = [component_data['id'].id for component_data in components]
+        shift_counter(ProductComponent, component_ids, 'recipes_count', 1)
+        component_index.add(recipe.pk, component_ids)
+
+
+class CookingRecipeReadSerializer(serializers.BaseSerializer):
+    """Представление рецепта для чтения.
+
+    Собирает ответ напрямую из предзагруженных данных и аннотаций
+    ``CookingRecipeQuerySet.with_user_flags`` без дополнительных запросов.
+    Формат ответа совпадает с ``CookingRecipeSerializer``.
+    """
+
+    def to_representation(self, recipe):
+        request = self.context.get('request')
+        creator = recipe.creator
+        return {
+            'id': recipe.id,
+            'creator': {
+                'username': creator.username,
+                'first_name': creator.first_name,
+                'last_name': creator.last_name,
+                'id': creator.id,
+                'email': creator.email,
+                'is_subscribed': recipe.creator_is_subscribed,
+                'avatar': build_image_url(creator.avatar, request),
+                'avatar_thumbnails': derivative_urls(
+                    creator.avatar, AVATAR_SIZES, request
+                ),
+            },
+            'title': recipe.title,
+            'description': recipe.description,
+            'picture': build_image_url(recipe.picture, request),
+            'picture_thumbnails': derivative_urls(
+                recipe.picture, RECIPE_PICTURE_SIZES, request
+            ),
+            'cook_duration': recipe.cook_duration,
+            'is_favorited': recipe.is_favorited,
+            'is_in_shopping_cart': recipe.is_in_shopping_cart,
+            'components': [
+                {
+                    'id': item.component.id,
+                    'title': item.component.title,
+                    'unit_type': item.component.unit_type,
+                    'quantity': item.quantity,
+                }
+                for item in recipe.recipe_components.all()
+            ],
+        }
 
 
 class CookingRecipeShortSerializer(serializers.ModelSerializer):
     
+    picture_thumbnails = ImageDerivativesField(
+        RECIPE_PICTURE_SIZES, source='picture'
+    )
 
     class Meta:
         model = CookingRecipe
-        fields = ('id', 'title', 'picture', 'cook_duration')
+        fields = ('id', 'title', 'picture', 'picture_thumbnails', 'cook_duration')
         read_only_fields = fields
 
 
 class UserSubscriptionSerializer(UserSerializer):
     
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(
-        source='recipes.count', read_only=True
-    )
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta(UserSerializer.Meta):
         fields = [*UserSerializer.Meta.fields, 'recipes', 'recipes_count']
         read_only_fields = fields
 
     def get_recipes(self, user):
-        recipes_queryset = user.recipes.all()
-        recipes_limit = self.context['request'].query_params.get('recipes_limit')
-        
-        if recipes_limit:
-            recipes_queryset = recipes_queryset[:int(recipes_limit)]
-        
         return CookingRecipeShortSerializer(
-            recipes_queryset, 
+            getattr(user, 'limited_recipes', user.recipes.all()), 
             many=True, 
             context=self.context
         ).data
+
+
+class SubscriptionQuerySerializer(serializers.Serializer):
+
+    recipes_limit = serializers.IntegerField(min_value=0, required=False)
+
+
+class CookableQuerySerializer(serializers.Serializer):
+
+    ingredients = serializers.RegexField(r'^\d+(,\d+)*$')
+    min_coverage = serializers.FloatField(min_value=0, max_value=1, default=0)
+
+    def validate_ingredients(self, ingredients):
+        component_ids = list(dict.fromkeys(map(int, ingredients.split(','))))
+        if len(component_ids) > COOKABLE_INGREDIENTS_LIMIT:
+            raise serializers.ValidationError(
+                f'Не больше {COOKABLE_INGREDIENTS_LIMIT} продуктов'
+            )
+        return component_ids
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_RECIPES_LIMIT
+    )
+
+    def validate_recipes(self, recipes):
+        return list(dict.fromkeys(recipes))
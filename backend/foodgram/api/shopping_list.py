@@ -0,0 +1,212 @@
+import csv
+import logging
+from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+from reportlab.pdfgen.canvas import Canvas
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import CookingRecipe, RecipeComponent
+
+CHUNK_SIZE = 500
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_FONT_SIZE = 11
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 16
+
+logger = logging.getLogger(__name__)
+
+
+class ExportUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Выгрузка в этом формате временно недоступна.'
+    default_code = 'export_unavailable'
+
+
+class ShoppingListRenderer(JSONRenderer):
+    """Выбирает формат списка покупок по ?format= или заголовку Accept.
+
+    Сам список отдаётся потоком в обход рендерера, через него
+    проходят только ответы с ошибками.
+    """
+
+    charset = 'utf-8'
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+def get_products(user):
+    return (
+        RecipeComponent.objects
+        .filter(recipe__shopping_items__user=user)
+        .values('component__title', 'component__unit_type')
+        .annotate(total_quantity=Sum('quantity'))
+        .order_by('component__title')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def get_recipes(user):
+    return (
+        CookingRecipe.objects
+        .filter(shopping_items__user=user)
+        .values('title', 'creator__username', 'creator__first_name', 'creator__last_name')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def format_product(index, item):
+    return (
+        f'{index}. {item["component__title"].capitalize()} - '
+        f'{item["total_quantity"]} {item["component__unit_type"]}'
+    )
+
+
+def format_recipe(recipe):
+    return (
+        f'• {recipe["title"]} (автор: '
+        f'{recipe["creator__first_name"]} {recipe["creator__last_name"]} '
+        f'@{recipe["creator__username"]})'
+    )
+
+
+def get_title():
+    return f'Список покупок на {datetime.now().strftime("%d.%m.%Y")}'
+
+
+def iter_lines(user):
+    yield get_title()
+    yield ''
+    yield 'ПРОДУКТЫ:'
+    for index, item in enumerate(get_products(user), 1):
+        yield format_product(index, item)
+    yield ''
+    yield 'РЕЦЕПТЫ:'
+    for recipe in get_recipes(user):
+        yield format_recipe(recipe)
+
+
+def stream_txt(user):
+    for line in iter_lines(user):
+        yield f'{line}\n'.encode()
+
+
+class Echo:
+    """Псевдофайл для csv.writer, возвращающий записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(user):
+    writer = csv.writer(Echo())
+    yield '\ufeff'.encode()
+    yield writer.writerow(('Продукт', 'Количество', 'Единица измерения')).encode()
+    for item in get_products(user):
+        yield writer.writerow((
+            item['component__title'].capitalize(),
+            item['total_quantity'],
+            item['component__unit_type'],
+        )).encode()
+    yield writer.writerow(()).encode()
+    yield writer.writerow(('Рецепт', 'Автор')).encode()
+    for recipe in get_recipes(user):
+        yield writer.writerow((
+            recipe['title'],
+            f'{recipe["creator__first_name"]} {recipe["creator__last_name"]} '
+            f'@{recipe["creator__username"]}',
+        )).encode()
+
+
+@lru_cache(maxsize=None)
+def get_pdf_font():
+    """Регистрирует шрифт с кириллицей один раз на процесс"""
+    pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT))
+    return PDF_FONT_NAME
+
+
+def wrap_pdf_line(line, font, width):
+    """Части строки не шире width: перенос по словам, слово длиннее
+    строки переносится по символам"""
+    for part in simpleSplit(line, font, PDF_FONT_SIZE, width) or ['']:
+        if stringWidth(part, font, PDF_FONT_SIZE) <= width:
+            yield part
+            continue
+        chunk = ''
+        for char in part:
+            if chunk and stringWidth(chunk + char, font, PDF_FONT_SIZE) > width:
+                yield chunk
+                chunk = ''
+            chunk += char
+        yield chunk
+
+
+def stream_pdf(user):
+    font = get_pdf_font()
+    buffer = BytesIO()
+    canvas = Canvas(buffer, pagesize=A4)
+    width, height = A4
+    y = height - PDF_MARGIN
+    canvas.setFont(font, PDF_FONT_SIZE)
+    for line in iter_lines(user):
+        for part in wrap_pdf_line(line, font, width - 2 * PDF_MARGIN):
+            if y < PDF_MARGIN:
+                canvas.showPage()
+                canvas.setFont(font, PDF_FONT_SIZE)
+                y = height - PDF_MARGIN
+            canvas.drawString(PDF_MARGIN, y, part)
+            y -= PDF_LINE_HEIGHT
+    canvas.save()
+    buffer.seek(0)
+    while chunk := buffer.read(64 * 1024):
+        yield chunk
+
+
+EXPORTS = {
+    'txt': (stream_txt, 'text/plain; charset=utf-8'),
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'pdf': (stream_pdf, 'application/pdf'),
+}
+
+
+def shopping_list_response(user, export_format):
+    if export_format not in EXPORTS:
+        export_format = 'txt'
+    if export_format == 'pdf':
+        # Ошибка внутри потока оборвала бы уже начатый ответ 200.
+        try:
+            get_pdf_font()
+        except (OSError, TTFError) as error:
+            logger.error('Не удалось загрузить шрифт для PDF: %s', error)
+            raise ExportUnavailable
+    stream, content_type = EXPORTS[export_format]
+    response = StreamingHttpResponse(stream(user), content_type=content_type)
+    response['Content-Disposition'] = content_disposition_header(
+        True, f'shopping_list.{export_format}'
+    )
+    return response
@@ -0,0 +1,46 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (
+    CookingRecipe, FavoriteRecipe, ProductComponent, RecipeComponent,
+    ShoppingCart, User
+)
+from .authentication import invalidate_tokens
+from .cache import bump_generation
+from .metrics import CONNECTIONS_OPENED, install_query_observers
+
+
+@receiver((post_save, post_delete), sender=CookingRecipe)
+@receiver((post_save, post_delete), sender=RecipeComponent)
+@receiver((post_save, post_delete), sender=ProductComponent)
+@receiver((post_save, post_delete), sender=FavoriteRecipe)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def invalidate_api_cache(sender, **kwargs):
+    bump_generation()
+
+
+@receiver((post_save, post_delete), sender=User)
+def invalidate_api_cache_on_profile_change(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login', 'password'}:
+        return
+    bump_generation()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_tokens(Token.objects.filter(user=instance).values_list('key', flat=True))
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    CONNECTIONS_OPENED.inc()
+    install_query_observers(connection)
@@ -1,2 +1,877 @@
+import base64
+import json
+import shutil
+import tempfile
+from io import BytesIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection, connections
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from recipes.bulk_load import copy_rows, delete_returning
+from recipes.component_index import VERSION_KEY, component_index, get_version
+from recipes.counters import reconcile_counters
+from recipes.images import RECIPE_PICTURE_SIZES, iter_derivative_names
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (
+    CookingRecipe, FavoriteRecipe, FeedEntry, ProductComponent,
+    RecipeComponent, ShoppingCart, User, UserSubscription
+)
+from .authentication import get_token_cache_key
+from .cache import get_stats
+from .benchmarks import build_dataset, load_baseline, measure, views_mode
+from .metrics import CONNECTIONS_OPENED
+from .nplusone import NPlusOneError, NPlusOneTestMixin
+from .pagination import RecipePagination
+from .serializers import (
+    CookingRecipeReadSerializer, CookingRecipeSerializer, SubscriptionQuerySerializer
+)
+from .shopping_list import PDF_FONT_SIZE, get_pdf_font, wrap_pdf_line
+
+SMALL_GIF = base64.b64decode(
+    'R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7'
+)
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class FoodgramTestCase(NPlusOneTestMixin, TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def create_user(cls, username, **kwargs):
+        return User.objects.create_user(
+            email=f'{username}@foodgram.ru', username=username,
+            first_name='Иван', last_name='Иванов', password='Pa$$w0rd!',
+            **kwargs
+        )
+
+    @classmethod
+    def create_recipe(cls, creator, components, title='Борщ'):
+        recipe = CookingRecipe.objects.create(
+            creator=creator, title=title, description='Сварить',
+            cook_duration=30,
+            picture=SimpleUploadedFile('dish.gif', SMALL_GIF, 'image/gif')
+        )
+        RecipeComponent.objects.bulk_create(
+            RecipeComponent(recipe=recipe, component=component, quantity=index)
+            for index, component in enumerate(components, 1)
+        )
+        return recipe
+
+
+class CookingRecipeReadSerializerTest(FoodgramTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user(
+            'author',
+            avatar=SimpleUploadedFile('avatar.gif', SMALL_GIF, 'image/gif')
+        )
+        cls.reader = cls.create_user('reader')
+        components = ProductComponent.objects.bulk_create([
+            ProductComponent(title='свёкла', unit_type='г'),
+            ProductComponent(title='капуста', unit_type='г'),
+        ])
+        cls.recipe = cls.create_recipe(cls.author, components)
+        FavoriteRecipe.objects.create(user=cls.reader, recipe=cls.recipe)
+        ShoppingCart.objects.create(user=cls.reader, recipe=cls.recipe)
+        UserSubscription.objects.create(
+            subscriber=cls.reader, target_user=cls.author
+        )
+
+    def assert_same_representation(self, user):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        context = {'request': request}
+        recipe = (
+            CookingRecipe.objects
+            .select_related('creator')
+            .prefetch_related('recipe_components__component')
+            .with_user_flags(user)
+            .get(pk=self.recipe.pk)
+        )
+        self.assertEqual(
+            json.dumps(CookingRecipeReadSerializer(recipe, context=context).data),
+            json.dumps(CookingRecipeSerializer(self.recipe, context=context).data)
+        )
+
+    def test_matches_full_serializer(self):
+        for user in (AnonymousUser(), self.reader, self.author):
+            with self.subTest(user=user):
+                self.assert_same_representation(user)
+
+
+class ShoppingListDownloadTest(FoodgramTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('reader')
+        salt = ProductComponent.objects.create(title='соль', unit_type='г')
+        cls.recipe = cls.create_recipe(cls.create_user('author'), [salt], 'Щи')
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipe)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = '/api/recipes/download-shopping-list/'
+
+    def test_csv_lists_products_and_recipes(self):
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        self.assertEqual(content.splitlines(), [
+            'Продукт,Количество,Единица измерения', 'Соль,1,г', '',
+            'Рецепт,Автор', 'Щи,Иван Иванов @author',
+        ])
+
+    def test_pdf_without_font_is_unavailable(self):
+        get_pdf_font.cache_clear()
+        self.addCleanup(get_pdf_font.cache_clear)
+        with override_settings(SHOPPING_LIST_PDF_FONT='/nonexistent.ttf'):
+            response = self.client.get(self.url, {'format': 'pdf'})
+        self.assertEqual(response.status_code, 503)
+
+    def test_pdf_lines_wrapped_to_page_width(self):
+        font = get_pdf_font()
+        width = 200
+        line = 'Щи ' * 40 + 'Щ' * 100
+        parts = list(wrap_pdf_line(line, font, width))
+        self.assertGreater(len(parts), 2)
+        for part in parts:
+            self.assertLessEqual(stringWidth(part, font, PDF_FONT_SIZE), width)
+        self.assertEqual(''.join(parts).replace(' ', ''), line.replace(' ', ''))
+        self.assertEqual(list(wrap_pdf_line('', font, width)), [''])
+
+
+class AnonymousCacheTest(FoodgramTestCase):
+    """Кэш ответов анонимным клиентам"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.reader = cls.create_user('reader')
+        cls.first = cls.create_recipe(cls.author, [], 'Щи')
+        cls.second = cls.create_recipe(cls.author, [], 'Борщ')
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = APIClient()
+
+    def test_hit_and_generation_miss(self):
+        url = '/api/recipes/?ordering=-favorites_count'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url).json()
+        self.assertEqual(get_stats()['hits'], 1)
+        reader = APIClient()
+        reader.force_authenticate(self.reader)
+        reader.post('/api/recipes/favorite/', {'recipes': [self.first.pk]}, format='json')
+        response = self.client.get(url).json()
+        self.assertEqual(get_stats()['misses'], 2)
+        self.assertEqual(
+            [recipe['id'] for recipe in response['results']],
+            [self.first.pk, self.second.pk]
+        )
+        self.assertNotEqual(response, cached)
+
+    def test_keyed_by_scheme_and_host(self):
+        url = f'/api/recipes/{self.first.pk}/'
+        plain = self.client.get(url).json()['picture']
+        secure = self.client.get(url, secure=True).json()['picture']
+        self.assertTrue(plain.startswith('http://testserver/'))
+        self.assertTrue(secure.startswith('https://testserver/'))
+
+
+class RecipePictureCleanupTest(FoodgramTestCase):
+
+    def picture_files(self, picture):
+        return [picture.name, *(
+            name for *_, name in iter_derivative_names(picture, RECIPE_PICTURE_SIZES)
+        )]
+
+    def test_unused_picture_removed_with_derivatives(self):
+        author = self.create_user('author')
+        first = self.create_recipe(author, [], 'Щи')
+        second = self.create_recipe(author, [], 'Борщ')
+        storage = first.picture.storage
+        files = self.picture_files(first.picture)
+        self.assertTrue(all(map(storage.exists, files)))
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(all(map(storage.exists, files)))
+        buffer = BytesIO()
+        Image.new('RGB', (2, 2), 'red').save(buffer, 'PNG')
+        second.picture = SimpleUploadedFile('new.png', buffer.getvalue(), 'image/png')
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        self.assertFalse(any(map(storage.exists, files)))
+        self.assertTrue(all(map(storage.exists, self.picture_files(second.picture))))
+
+
+class ConditionalGetTest(FoodgramTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.reader = cls.create_user('reader')
+        cls.component = ProductComponent.objects.create(
+            title='свёкла', unit_type='г'
+        )
+        cls.recipe = cls.create_recipe(cls.author, [cls.component])
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def assert_revalidates(self, url, change):
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_recipe_list_changes_with_favorites(self):
+        self.assert_revalidates(
+            '/api/recipes/',
+            lambda: FavoriteRecipe.objects.create(
+                user=self.reader, recipe=self.recipe
+            )
+        )
+
+    def test_recipe_detail_changes_with_component(self):
+        def rename():
+            self.component.title = 'морковь'
+            self.component.save()
+        self.assert_revalidates(f'/api/recipes/{self.recipe.pk}/', rename)
+
+    def test_recipe_list_changes_on_delete(self):
+        self.client.force_authenticate(None)
+        response = self.client.get('/api/recipes/')
+        self.assertNotIn('Last-Modified', response)
+        recipe = self.create_recipe(self.author, [], 'Щи')
+        self.assert_revalidates('/api/recipes/', recipe.delete)
+
+    def test_anonymous_last_modified(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(f'/api/users/{self.author.pk}/')
+        response = self.client.get(
+            f'/api/users/{self.author.pk}/',
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class RecipeCursorPaginationTest(FoodgramTestCase):
+    """Keyset-режим RecipePagination по ?cursor="""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = cls.create_user('author')
+        cls.recipes = [
+            cls.create_recipe(author, [], title=f'Рецепт {index}')
+            for index in range(5)
+        ]
+
+    def test_cursor_round_trip(self):
+        paginator = RecipePagination()
+        date_created = self.recipes[0].date_created
+        cursor = paginator.encode_cursor(date_created, 42)
+        self.assertEqual(paginator.decode_cursor(cursor), (date_created, 42))
+        self.assertIsNone(paginator.decode_cursor(''))
+
+    def test_malformed_cursor_is_not_found(self):
+        paginator = RecipePagination()
+        for cursor in ('!!!', base64.urlsafe_b64encode(b'2024-01-01|x').decode(),
+                       base64.urlsafe_b64encode(b'\xff').decode()):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(NotFound):
+                    paginator.decode_cursor(cursor)
+        response = APIClient().get('/api/recipes/', {'cursor': 'bm9wZQ'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_ties_on_date_created_paged_by_id(self):
+        # Две пары рецептов с одинаковым временем создания.
+        first, second, third, fourth, fifth = self.recipes
+        CookingRecipe.objects.filter(pk__in=(first.pk, second.pk)).update(
+            date_created=first.date_created
+        )
+        CookingRecipe.objects.filter(pk__in=(third.pk, fourth.pk)).update(
+            date_created=fifth.date_created
+        )
+        client = APIClient()
+        url = '/api/recipes/?cursor=&limit=2'
+        ids = []
+        while url:
+            page = client.get(url).json()
+            self.assertNotIn('count', page)
+            ids += [recipe['id'] for recipe in page['results']]
+            url = page['next']
+        self.assertEqual(
+            ids, [fifth.pk, fourth.pk, third.pk, second.pk, first.pk]
+        )
+
+
+class SubscriptionFeedTest(FoodgramTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = cls.create_user('reader')
+        cls.author = cls.create_user('author')
+        cls.celebrity = cls.create_user('celebrity')
+        cls.component = ProductComponent.objects.create(
+            title='свёкла', unit_type='г'
+        )
+        cls.old_recipe = cls.create_recipe(cls.author, [cls.component])
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def get_feed(self, url='/api/recipes/feed/?limit=2'):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    @override_settings(FEED_FANOUT_LIMIT=2)
+    def test_feed_merges_timeline_and_celebrities(self):
+        UserSubscription.objects.create(subscriber=self.reader, target_user=self.author)
+        UserSubscription.objects.create(subscriber=self.reader, target_user=self.celebrity)
+        UserSubscription.objects.create(subscriber=self.author, target_user=self.celebrity)
+        new_recipe = self.create_recipe(self.author, [self.component])
+        celebrity_recipe = self.create_recipe(self.celebrity, [self.component])
+        self.assertFalse(
+            FeedEntry.objects.filter(recipe=celebrity_recipe).exists()
+        )
+
+        page = self.get_feed()
+        self.assertEqual(
+            [recipe['id'] for recipe in page['results']],
+            [celebrity_recipe.pk, new_recipe.pk]
+        )
+        page = self.get_feed(page['next'])
+        self.assertEqual(
+            [recipe['id'] for recipe in page['results']], [self.old_recipe.pk]
+        )
+        self.assertIsNone(page['next'])
+
+    def test_unsubscribe_clears_feed(self):
+        subscription = UserSubscription.objects.create(
+            subscriber=self.reader, target_user=self.author
+        )
+        self.assertEqual(len(self.get_feed()['results']), 1)
+        subscription.delete()
+        self.assertEqual(self.get_feed()['results'], [])
+
+
+class SubscriptionRecipesLimitTest(FoodgramTestCase):
+    """recipes_limit ограничивает рецепты каждого автора, но не их число"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = cls.create_user('reader')
+        cls.prolific = cls.create_user('prolific')
+        cls.newcomer = cls.create_user('newcomer')
+        cls.recipes = [
+            cls.create_recipe(cls.prolific, [], title=f'Рецепт {index}')
+            for index in range(3)
+        ]
+        cls.create_recipe(cls.newcomer, [])
+        UserSubscription.objects.create(subscriber=cls.reader, target_user=cls.prolific)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def get_authors(self, **params):
+        response = self.client.get('/api/users/subscriptions/', params)
+        self.assertEqual(response.status_code, 200)
+        return {
+            author['username']: author for author in response.json()['results']
+        }
+
+    def test_limit_applies_per_author(self):
+        UserSubscription.objects.create(subscriber=self.reader, target_user=self.newcomer)
+        authors = self.get_authors(recipes_limit=2)
+        prolific = authors['prolific']
+        self.assertEqual(
+            [recipe['id'] for recipe in prolific['recipes']],
+            [self.recipes[2].pk, self.recipes[1].pk]
+        )
+        self.assertEqual(prolific['recipes_count'], 3)
+        self.assertEqual(len(authors['newcomer']['recipes']), 1)
+        self.assertEqual(authors['newcomer']['recipes_count'], 1)
+        self.assertEqual(len(self.get_authors()['prolific']['recipes']), 3)
+        self.assertEqual(self.get_authors(recipes_limit=0)['prolific']['recipes'], [])
+
+    def test_limit_on_subscribe(self):
+        UserSubscription.objects.all().delete()
+        response = self.client.post(
+            f'/api/users/{self.prolific.pk}/subscribe/?recipes_limit=1'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['recipes']), 1)
+        self.assertEqual(response.json()['recipes_count'], 3)
+
+    def test_invalid_limit_rejected(self):
+        for value in ('-1', 'abc', '1.5'):
+            with self.subTest(value=value):
+                query = SubscriptionQuerySerializer(data={'recipes_limit': value})
+                self.assertFalse(query.is_valid())
+                self.assertIn('recipes_limit', query.errors)
+                response = self.client.get(
+                    '/api/users/subscriptions/', {'recipes_limit': value}
+                )
+                self.assertEqual(response.status_code, 400)
+
+
+class BulkRecipeRelationTest(FoodgramTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('reader')
+        author = cls.create_user('author')
+        component = ProductComponent.objects.create(title='свёкла', unit_type='г')
+        cls.recipes = [
+            cls.create_recipe(author, [component], title=f'Рецепт {index}')
+            for index in range(2)
+        ]
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_add_and_remove(self):
+        first, second = (recipe.pk for recipe in self.recipes)
+        ShoppingCart.objects.create(user=self.user, recipe_id=first)
+        url = '/api/recipes/shopping_cart/'
+        response = self.client.post(
+            url, {'recipes': [first, second, 999999]}, format='json'
+        )
+        self.assertEqual(response.json()['results'], [
+            {'id': first, 'status': 'exists'},
+            {'id': second, 'status': 'added'},
+            {'id': 999999, 'status': 'not_found'},
+        ])
+        self.assertEqual(
+            CookingRecipe.objects.get(pk=second).shopping_cart_count, 1
+        )
+        response = self.client.delete(url, {'recipes': [first, second]}, format='json')
+        self.assertEqual(
+            [result['status'] for result in response.json()['results']],
+            ['removed', 'removed']
+        )
+        self.assertFalse(ShoppingCart.objects.filter(user=self.user).exists())
+        self.assertEqual(
+            list(CookingRecipe.objects.values_list('shopping_cart_count', flat=True)),
+            [0, 0]
+        )
+
+    def test_counters_shift_only_for_changed_rows(self):
+        first = self.recipes[0].pk
+        url = '/api/recipes/favorite/'
+        # Строка, вставленная параллельным запросом после проверки.
+        FavoriteRecipe.objects.bulk_create([FavoriteRecipe(user=self.user, recipe_id=first)])
+        self.client.post(url, {'recipes': [first]}, format='json')
+        self.assertEqual(CookingRecipe.objects.get(pk=first).favorites_count, 0)
+        delete_returning(FavoriteRecipe.objects.filter(user=self.user), 'recipe')
+        for status in ('added', 'exists'):
+            response = self.client.post(url, {'recipes': [first]}, format='json')
+            self.assertEqual(response.json()['results'][0]['status'], status)
+        for status in ('removed', 'not_found'):
+            response = self.client.delete(url, {'recipes': [first]}, format='json')
+            self.assertEqual(response.json()['results'][0]['status'], status)
+        self.assertEqual(CookingRecipe.objects.get(pk=first).favorites_count, 0)
+
+    def test_single_recipe_shares_bulk_path(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.pk}/favorite/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['id'], recipe.pk)
+        self.assertEqual(CookingRecipe.objects.get(pk=recipe.pk).favorites_count, 1)
+        for status_code in (204, 404):
+            self.assertEqual(self.client.delete(url).status_code, status_code)
+        self.assertEqual(CookingRecipe.objects.get(pk=recipe.pk).favorites_count, 0)
+        self.assertEqual(self.client.post('/api/recipes/0/favorite/').status_code, 404)
+
+
+class QueryBudgetTest(FoodgramTestCase):
+    """Число запросов эндпоинтов на малом наборе данных совпадает
+    с базовой линией бенчмарка (manage.py benchmark_api), снятой на
+    большом: при N+1 они расходятся, а при улучшении бюджет нужно
+    уменьшить"""
+
+    def test_endpoints_match_query_budgets(self):
+        dataset = build_dataset(users=6, recipes=12, products=20)
+        budgets = load_baseline()['queries']
+        for name, result in measure(dataset, iterations=1, warmup=1).items():
+            with self.subTest(endpoint=name):
+                self.assertEqual(result['queries'], budgets[name])
+
+
+class MetricsMiddlewareTest(FoodgramTestCase):
+
+    def test_disabled_by_default(self):
+        response = APIClient().get('/api/recipes/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(APIClient().get('/metrics').status_code, 403)
+        client = APIClient()
+        client.force_login(self.create_user('staff', is_staff=True))
+        self.assertEqual(client.get('/metrics').status_code, 200)
+
+    @override_settings(SERVER_TIMING_ENABLED=True, METRICS_TOKEN='secret')
+    def test_server_timing_and_histograms(self):
+        author = self.create_user('author')
+        self.create_recipe(author, [ProductComponent.objects.create(title='Соль', unit_type='г')])
+        response = APIClient().get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'app;dur=', 'render;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+        self.assertNotIn('db;dur=0.0;desc="0 queries"', timing)
+
+        self.assertEqual(
+            APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403
+        )
+        metrics = APIClient().get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer secret'
+        ).content.decode()
+        self.assertIn(
+            'foodgram_request_duration_seconds_count'
+            '{view="CookingRecipeViewSet.list",method="GET"}',
+            metrics
+        )
+        self.assertIn('foodgram_db_queries_bucket', metrics)
+        self.assertIn('foodgram_db_connections_opened_total', metrics)
+
+
+class DatabaseConnectionTest(FoodgramTestCase):
+    """Метрики соединений и загрузка COPY для psycopg2 и psycopg 3"""
+
+    @override_settings(METRICS_TOKEN='secret')
+    def get_metrics(self):
+        return APIClient().get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer secret'
+        ).content.decode()
+
+    def test_opened_connections_counted(self):
+        opened = CONNECTIONS_OPENED.value
+        wrapper = connections.create_connection('default')
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        self.assertEqual(CONNECTIONS_OPENED.value, opened + 1)
+        self.assertIn(
+            f'foodgram_db_connections_opened_total {opened + 1}\n',
+            self.get_metrics()
+        )
+
+    def test_pool_stats_rendered(self):
+        class Pool:
+            def get_stats(self):
+                return {'pool_size': 4, 'pool_available': 1, 'requests_waiting': 2}
+
+        self.assertNotIn('foodgram_db_pool_size', self.get_metrics())
+        connection.pool = Pool()
+        self.addCleanup(delattr, connection, 'pool')
+        metrics = self.get_metrics()
+        for line in (
+            'foodgram_db_pool_size{alias="default"} 4',
+            'foodgram_db_pool_available{alias="default"} 1',
+            'foodgram_db_requests_waiting{alias="default"} 2',
+            'foodgram_db_requests_errors_total{alias="default"} 0',
+        ):
+            self.assertIn(line, metrics)
+
+    def test_copy_rows_accepts_both_drivers(self):
+        sql = 'COPY recipes (id, title) FROM STDIN WITH (FORMAT csv)'
+        rows = [(1, 'Щи'), (2, 'Суп, с зеленью')]
+        expected = '1,Щи\r\n2,"Суп, с зеленью"\r\n'
+
+        class Psycopg2Cursor:
+            def copy_expert(self, query, file):
+                self.copied = (query, file.read())
+
+        class Copy:
+            def __init__(self):
+                self.data = ''
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                return False
+
+            def write(self, data):
+                self.data += data
+
+        class Psycopg3Cursor:
+            def copy(self, query):
+                self.query, self.target = query, Copy()
+                return self.target
+
+        cursor = Psycopg2Cursor()
+        copy_rows(cursor, 'recipes', ('id', 'title'), rows)
+        self.assertEqual(cursor.copied, (sql, expected))
+        cursor = Psycopg3Cursor()
+        copy_rows(cursor, 'recipes', ('id', 'title'), rows)
+        self.assertEqual((cursor.query, cursor.target.data), (sql, expected))
+
+
+class NPlusOneDetectorTest(FoodgramTestCase):
+
+    def test_repeated_queries_raise_with_location(self):
+        components = [ProductComponent.objects.create(title='Соль', unit_type='г')]
+        for index in range(3):
+            self.create_recipe(self.create_user(f'author{index}'), components)
+        with self.assertRaisesMessage(NPlusOneError, 'api/tests.py'):
+            with self.assertNoNPlusOne():
+                [recipe.creator.username for recipe in CookingRecipe.objects.all()]
+        with self.assertNoNPlusOne():
+            [
+                recipe.creator.username
+                for recipe in CookingRecipe.objects.select_related('creator')
+            ]
+
+
+class CachedTokenAuthenticationTest(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('reader')
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}'
+        )
+
+    def count_queries(self, method='get', url='/api/users/me/', status=200):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url)
+        self.assertEqual(response.status_code, status)
+        return len(context.captured_queries)
+
+    def test_cached_token_skips_lookup(self):
+        self.assertEqual(self.count_queries() - 1, self.count_queries())
+
+    def test_password_hash_not_cached(self):
+        self.count_queries()
+        key = Token.objects.get(user=self.user).key
+        cached = cache.get(get_token_cache_key(key))
+        self.assertIn('password', cached.user.get_deferred_fields())
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'Pa$$w0rd!', 'new_password': 'N3w-Pa$$w0rd!'
+        })
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('N3w-Pa$$w0rd!'))
+
+    def test_invalidated_on_deactivation_and_logout(self):
+        self.count_queries()
+        self.user.first_name = 'Пётр'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').data['first_name'], 'Пётр')
+        self.count_queries('post', '/api/auth/token/logout/', 204)
+        self.count_queries(status=401)
+
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.count_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.count_queries(status=401)
+
+
+class AsyncReadViewsTest(FoodgramTestCase):
+    """Асинхронные представления отвечают так же, как синхронные"""
+
+    def test_async_views_match_sync(self):
+        author = self.create_user('author')
+        reader = self.create_user('reader')
+        recipe = self.create_recipe(
+            author, [ProductComponent.objects.create(title='Салат', unit_type='г')]
+        )
+        FavoriteRecipe.objects.create(user=reader, recipe=recipe)
+        token = Token.objects.create(user=reader)
+        requests = [
+            (url, auth)
+            for url in (
+                '/api/ingredients/', '/api/ingredients/?name=сал',
+                f'/api/recipes/{recipe.pk}/', '/api/recipes/0/',
+                f'/api/recipes/{recipe.pk}/get-link/', f'/s/{recipe.short_code}/',
+            )
+            for auth in ({}, {'HTTP_AUTHORIZATION': f'Token {token.key}'})
+        ]
+        responses = {}
+        for async_views in (False, True):
+            with views_mode(async_views):
+                for url, auth in requests:
+                    response = APIClient().get(url, **auth)
+                    self.assertEqual(
+                        iscoroutinefunction(response.resolver_match.func),
+                        async_views, url
+                    )
+                    responses.setdefault((url, bool(auth)), []).append(response)
+        for (url, auth), (sync, async_) in responses.items():
+            with self.subTest(url=url, auth=auth):
+                self.assertEqual(sync.status_code, async_.status_code)
+                self.assertEqual(sync.get('ETag'), async_.get('ETag'))
+                if sync.status_code == 302:
+                    self.assertEqual(sync.url, async_.url)
+                else:
+                    self.assertEqual(sync.json(), async_.json())
+
+    def test_ingredient_snapshot_survives_invalidation(self):
+        ProductComponent.objects.create(title='Салат', unit_type='г')
+        snapshot = async_to_sync(ingredient_index.aload)()
+        ingredient_index.invalidate()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ingredient_index.modification_state(snapshot)['count'], 1
+            )
+            self.assertEqual(
+                [item['title'] for item in ingredient_index.search('сал', snapshot=snapshot)],
+                ['Салат']
+            )
+
+    def test_writes_delegated_without_csrf(self):
+        author = self.create_user('author')
+        recipe = self.create_recipe(
+            author, [ProductComponent.objects.create(title='Салат', unit_type='г')]
+        )
+        token = Token.objects.create(user=self.create_user('reader'))
+        for async_views in (False, True):
+            with self.subTest(async_views=async_views), views_mode(async_views):
+                client = APIClient(enforce_csrf_checks=True)
+                client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+                self.assertEqual(client.delete('/api/recipes/0/').status_code, 404)
+                response = client.patch(
+                    f'/api/recipes/{recipe.pk}/', {'title': 'Суп'}, format='json'
+                )
+                self.assertEqual(response.status_code, 403)
+                self.assertIn('detail', response.json())
+
+
+class ComponentIndexTest(FoodgramTestCase):
+    """Фильтры по продуктам и подбор рецептов по обратному индексу"""
+
+    def setUp(self):
+        super().setUp()
+        component_index.invalidate()
+        self.author = self.create_user('author')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.egg, self.milk, self.flour, self.salt = ProductComponent.objects.bulk_create(
+            ProductComponent(title=title, unit_type='г')
+            for title in ('яйцо', 'молоко', 'мука', 'соль')
+        )
+        self.omelette = self.create_recipe(
+            self.author, [self.egg, self.milk, self.salt], 'Омлет'
+        )
+        self.pancakes = self.create_recipe(
+            self.author, [self.egg, self.milk, self.flour, self.salt], 'Блины'
+        )
+        reconcile_counters()
+
+    def get_ids(self, query):
+        response = self.client.get(f'/api/recipes/?{query}')
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_ingredient_filters(self):
+        self.assertEqual(
+            self.get_ids(f'ingredients={self.egg.pk},{self.milk.pk}'),
+            [self.pancakes.pk, self.omelette.pk]
+        )
+        self.assertEqual(
+            self.get_ids(f'ingredients={self.egg.pk}&exclude_ingredients={self.flour.pk}'),
+            [self.omelette.pk]
+        )
+        self.assertEqual(
+            self.get_ids(f'exclude_ingredients={self.flour.pk}'), [self.omelette.pk]
+        )
+
+    def test_cookable_ranked_by_coverage(self):
+        pantry = f'{self.egg.pk},{self.milk.pk},{self.flour.pk}'
+        results = self.client.get(
+            f'/api/recipes/cookable/?ingredients={pantry}'
+        ).json()['results']
+        self.assertEqual(
+            [(item['id'], item['matched_ingredients'], item['total_ingredients'])
+             for item in results],
+            [(self.pancakes.pk, 3, 4), (self.omelette.pk, 2, 3)]
+        )
+        response = self.client.get(
+            f'/api/recipes/cookable/?ingredients={pantry}&min_coverage=0.7'
+        )
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(
+            self.client.get('/api/recipes/cookable/?ingredients=x').status_code, 400
+        )
+
+    def test_index_follows_component_writes(self):
+        self.get_ids(f'ingredients={self.salt.pk}')
+        response = self.client.post('/api/recipes/', {
+            'title': 'Лепёшка', 'description': 'Замесить', 'cook_duration': 10,
+            'picture': 'data:image/gif;base64,' + base64.b64encode(SMALL_GIF).decode(),
+            'components': [
+                {'id': self.flour.pk, 'quantity': 100},
+                {'id': self.salt.pk, 'quantity': 1},
+            ],
+        }, format='json')
+        flatbread = response.json()['id']
+        self.assertEqual(
+            self.get_ids(f'ingredients={self.flour.pk},{self.salt.pk}'),
+            [flatbread, self.pancakes.pk]
+        )
+        self.pancakes.delete()
+        RecipeComponent.objects.filter(recipe=self.omelette, component=self.salt).delete()
+        self.assertEqual(self.get_ids(f'ingredients={self.salt.pk}'), [flatbread])
+
+    def test_index_follows_other_process_writes(self):
+        self.assertEqual(self.get_ids(f'ingredients={self.flour.pk}'), [self.pancakes.pk])
+        # Запись другого процесса: без сигналов, но с журналом в кэше.
+        RecipeComponent.objects.bulk_create([
+            RecipeComponent(recipe=self.omelette, component=self.flour, quantity=1)
+        ])
+        component_index._log((1, self.omelette.pk, [self.flour.pk]))
+
+        def build():
+            raise AssertionError('индекс перестроен в запросе')
+        component_index._build = build
+        self.addCleanup(delattr, component_index, '_build')
+        self.assertEqual(
+            self.get_ids(f'ingredients={self.flour.pk}'),
+            [self.pancakes.pk, self.omelette.pk]
+        )
+        version = get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeComponent.objects.filter(
+                recipe=self.omelette, component=self.flour
+            ).delete()
+        self.assertEqual(get_version(), version + 1)
+        self.assertEqual(self.get_ids(f'ingredients={self.flour.pk}'), [self.pancakes.pk])
+        # Пропуск в журнале не ломает запросы: индекс ждёт перестройки.
+        cache.incr(VERSION_KEY)
+        component_index._log((-1, self.pancakes.pk, [self.flour.pk]))
+        self.assertEqual(self.get_ids(f'ingredients={self.flour.pk}'), [self.pancakes.pk])
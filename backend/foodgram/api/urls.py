@@ -1,10 +1,13 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from . import async_views
 from .views import (
     ProductComponentViewSet,
     CookingRecipeViewSet,
     UserViewSet,
+    cache_stats,
 )
 
 router = DefaultRouter()
@@ -13,6 +16,21 @@ router.register(r'ingredients', ProductComponentViewSet,  basename='ingredients'
 router.register(r'users', UserViewSet, basename='users')
 
 urlpatterns = [
+    path('cache-stats/', cache_stats, name='cache-stats'),
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
-]
\ No newline at end of file
+]
+if settings.ASYNC_VIEWS:
+    # Самые частые запросы на чтение без переходов в поток под ASGI.
+    sync_views = {
+        pattern.name: pattern.callback for pattern in router.urls
+    }
+    urlpatterns = [
+        path('ingredients/', async_views.ingredient_list,
+             {'sync_view': sync_views['ingredients-list']}),
+        path('recipes/<int:pk>/', async_views.recipe_detail,
+             {'sync_view': sync_views['recipes-detail']}),
+        path('recipes/<int:pk>/get-link/', async_views.recipe_get_link,
+             {'sync_view': sync_views['recipes-get-link']}),
+        *urlpatterns,
+    ]
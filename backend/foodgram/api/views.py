@@ -1,81 +1,172 @@
-from datetime import datetime
-from django.db.models import Sum
 from django.forms import ValidationError
-from django.http import FileResponse
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.db.models import Count, Exists, Max, OuterRef, Prefetch, Value
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from rest_framework import filters, viewsets, permissions, status
+from rest_framework import viewsets, permissions, status
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import AllowAny
 from rest_framework.pagination import LimitOffsetPagination
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 
-from recipes.models import CookingRecipe, ProductComponent, ShoppingCart, RecipeComponent, FavoriteRecipe
+from recipes.models import CookingRecipe, ProductComponent, ShoppingCart, FavoriteRecipe
 from recipes.models import UserSubscription, User
+from recipes.bulk_load import delete_returning, insert_returning
+from recipes.counters import shift_related_counters
+from recipes.images import AVATAR_SIZES, delete_derivatives
+from recipes.component_index import component_index
+from recipes.ingredient_index import ingredient_index
 from .serializers import (
     ProductSerializer, CookingRecipeSerializer, CookingRecipeShortSerializer, 
+    CookingRecipeReadSerializer, CookableQuerySerializer, RecipeIdsSerializer,
+    SubscriptionQuerySerializer,
     UserSubscriptionSerializer, UserSerializer
 )
+from .cache import AnonymousCacheMixin, bump_generation, get_stats
+from .conditional import ConditionalGetMixin
+from .pagination import FeedPagination, RecipePagination
 from .permissions import CreatorOrReadOnly
-from .filters import CookingRecipeFilter
+from .shopping_list import (
+    CSVShoppingListRenderer, PDFShoppingListRenderer,
+    TextShoppingListRenderer, shopping_list_response
+)
+from .filters import CookingRecipeFilter, RecipeSearchFilter
 
 UserModel = get_user_model()
 
 
-class ProductComponentViewSet(viewsets.ReadOnlyModelViewSet):
+class ProductComponentViewSet(
+    ConditionalGetMixin, AnonymousCacheMixin, viewsets.ReadOnlyModelViewSet
+):
     
     queryset = ProductComponent.objects.all()
     serializer_class = ProductSerializer
     pagination_class = None
     permission_classes = [AllowAny]
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter)
-    filterset_fields = ('title',)
-    search_fields = ('^title',)
 
-    def get_queryset(self):
-        search_term = self.request.query_params.get('title')
+    def get_modification_state(self, request):
+        if self.action == 'list':
+            return ingredient_index.modification_state()
+        state = self.filter_lookup(ProductComponent.objects.all()).aggregate(
+            count=Count('pk'), components=Max('updated_at')
+        )
+        return state if state['count'] else None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(self.search_index, request, *args, **kwargs)
+
+    def search_index(self, request, *args, **kwargs):
+        """Список продуктов из префиксного индекса, без запросов к БД"""
+        search_term = (
+            request.query_params.get('name')
+            or request.query_params.get('title')
+        )
         if search_term:
-            return self.queryset.filter(title__istartswith=search_term)
-        return self.queryset
+            return Response(ingredient_index.search(search_term))
+        return Response(ingredient_index.all())
 
 
-class CookingRecipeViewSet(viewsets.ModelViewSet):
+class CookingRecipeViewSet(
+    ConditionalGetMixin, AnonymousCacheMixin, viewsets.ModelViewSet
+):
     
     serializer_class = CookingRecipeSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = RecipePagination
     permission_classes = (CreatorOrReadOnly,)
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter)
+    filter_backends = (DjangoFilterBackend, RecipeSearchFilter, OrderingFilter)
     search_fields = ('title',)
+    ordering_fields = ('date_created', 'favorites_count')
     filterset_class = CookingRecipeFilter
 
     def get_queryset(self):
         return (
             CookingRecipe.objects
+            .defer('search_vector')
             .select_related('creator')
-            .prefetch_related('recipe_components__component', 'favorite_recipes', 'shopping_items')
+            .prefetch_related('recipe_components__component')
+            .with_user_flags(self.request.user)
         )
 
+    def get_serializer_class(self):
+        if self.action in ('list', 'retrieve'):
+            return CookingRecipeReadSerializer
+        return CookingRecipeSerializer
+
+    def get_modification_state(self, request):
+        if self.action == 'list':
+            return self.list_state()
+        state = self.filter_lookup(CookingRecipe.objects.all()).modification_state()
+        return state if state['count'] else None
+
     def perform_create(self, serializer):
         serializer.save(creator=self.request.user)
 
-    def _handle_recipe_relation(self, request, pk, model_class):
-        
-        recipe = get_object_or_404(CookingRecipe, pk=pk)
+    def _handle_recipe_relation(self, request, model_class, pk=None):
+        """Добавление и удаление рецептов из избранного или корзины:
+        одного рецепта из адреса или списка ``recipes`` из тела запроса.
+
+        Добавление и удаление выполняются одним запросом без сигналов,
+        поэтому счётчики рецептов обновляются здесь же, только для строк,
+        которые запрос действительно вставил или удалил: параллельные
+        запросы не сдвигают счётчик дважды. Для списка возвращается
+        результат по каждому id: added, exists, removed или not_found.
+        """
+        if pk is None:
+            serializer = RecipeIdsSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            recipe_ids = serializer.validated_data['recipes']
+        else:
+            recipe = get_object_or_404(CookingRecipe, pk=pk)
+            recipe_ids = [recipe.pk]
         user = request.user
-        verbose = model_class._meta.verbose_name
         if request.method == 'POST':
-            _, created = model_class.objects.get_or_create(user=user, recipe=recipe)
-            if not created:
-                raise ValidationError({
-                    'detail': f'{verbose.capitalize()} для рецепта "{recipe.title}" уже существует.'
-                })
+            existing = recipe_ids if pk is not None else list(
+                CookingRecipe.objects.filter(pk__in=recipe_ids)
+                .values_list('pk', flat=True)
+            )
+            added = insert_returning(
+                model_class, ('user', 'recipe'),
+                [(user.pk, recipe_id) for recipe_id in existing], 'recipe'
+            )
+            shift_related_counters(model_class, 'recipe', added, 1)
+            added = set(added)
+            results = {
+                recipe_id: 'added' if recipe_id in added else 'exists'
+                for recipe_id in existing
+            }
+        else:
+            removed = delete_returning(
+                model_class.objects.filter(user=user, recipe_id__in=recipe_ids),
+                'recipe'
+            )
+            shift_related_counters(model_class, 'recipe', removed, -1)
+            results = {recipe_id: 'removed' for recipe_id in removed}
+        # Вставка и удаление идут в обход сигналов, а от счётчиков
+        # зависит сортировка по популярности.
+        if {'added', 'removed'} & set(results.values()):
+            bump_generation()
+        if pk is None:
+            return Response({'results': [
+                {'id': recipe_id, 'status': results.get(recipe_id, 'not_found')}
+                for recipe_id in recipe_ids
+            ]})
+        result = results.get(recipe.pk)
+        if result == 'added':
             serializer = CookingRecipeShortSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        get_object_or_404(model_class, user=user, recipe=recipe).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        if result == 'exists':
+            verbose = model_class._meta.verbose_name
+            raise ValidationError({
+                'detail': f'{verbose.capitalize()} для рецепта "{recipe.title}" уже существует.'
+            })
+        if result == 'removed':
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        raise Http404(f'No {model_class._meta.object_name} matches the given query.')
 
     @action(
         detail=True, 
@@ -84,52 +175,78 @@ class CookingRecipeViewSet(viewsets.ModelViewSet):
         permission_classes=[permissions.IsAuthenticated]
     )
     def handle_shopping_cart(self, request, pk=None):
-        return self._handle_recipe_relation(request, pk, ShoppingCart)
+        return self._handle_recipe_relation(request, ShoppingCart, pk)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    def bulk_shopping_cart(self, request):
+        return self._handle_recipe_relation(request, ShoppingCart)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='feed',
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь"""
+        paginator = FeedPagination()
+        recipe_ids = paginator.paginate_feed(request.user, request)
+        serializer = CookingRecipeReadSerializer(
+            self.get_queryset().filter(pk__in=recipe_ids),
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='cookable',
+        permission_classes=[AllowAny]
+    )
+    def cookable(self, request):
+        """Рецепты из продуктов ?ingredients=1,2,3 по убыванию доли
+        имеющихся продуктов, с числом имеющихся и всех продуктов"""
+        query = CookableQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        ranked = component_index.rank(
+            query.validated_data['ingredients'],
+            query.validated_data['min_coverage']
+        )
+        paginator = LimitOffsetPagination()
+        page = paginator.paginate_queryset(ranked, request, view=self)
+        recipes = self.get_queryset().in_bulk([pk for pk, *_ in page])
+        page = [row for row in page if row[0] in recipes]
+        serializer = CookingRecipeReadSerializer(
+            [recipes[pk] for pk, *_ in page],
+            many=True,
+            context=self.get_serializer_context()
+        )
+        data = serializer.data
+        for item, (_, matched, total) in zip(data, page):
+            item['matched_ingredients'] = matched
+            item['total_ingredients'] = total
+        return paginator.get_paginated_response(data)
 
     @action(
         detail=False, 
         methods=['get'], 
         url_path='download-shopping-list',
-        permission_classes=[permissions.IsAuthenticated]
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=[
+            JSONRenderer, TextShoppingListRenderer,
+            CSVShoppingListRenderer, PDFShoppingListRenderer
+        ]
     )
     def download_shopping_list(self, request):
-        user = request.user
-        shopping_list = (
-            RecipeComponent.objects
-            .filter(recipe__shopping_items__user=user) 
-            .values('component__title', 'component__unit_type')
-            .annotate(total_quantity=Sum('quantity'))
-            .order_by('component__title')
-        )
-        recipes_in_cart = (
-            CookingRecipe.objects
-            .filter(shopping_items__user=user)  
-            .select_related('creator')
-            .values('title', 'creator__username', 'creator__first_name', 'creator__last_name')
-        )
-        content = '\n'.join([
-            f'Список покупок на {datetime.now().strftime("%d.%m.%Y")}',
-            '',
-            'ПРОДУКТЫ:',
-            *[
-                f'{index}. {item["component__title"].capitalize()} - '
-                f'{item["total_quantity"]} {item["component__unit_type"]}'
-                for index, item in enumerate(shopping_list, 1)
-            ],
-            '',
-            'РЕЦЕПТЫ:',
-            *[
-                f'• {recipe["title"]} (автор: '
-                f'{recipe["creator__first_name"]} {recipe["creator__last_name"]} '
-                f'@{recipe["creator__username"]})'
-                for recipe in recipes_in_cart
-            ],
-        ])
-        return FileResponse(
-            content,
-            as_attachment=True,
-            filename='shopping_list.txt',
-            content_type='text/plain'
+        """Список покупок в формате txt, csv или pdf"""
+        return shopping_list_response(
+            request.user, request.accepted_renderer.format
         )
 
     @action(
@@ -139,7 +256,16 @@ class CookingRecipeViewSet(viewsets.ModelViewSet):
         permission_classes=[permissions.IsAuthenticated]
     )
     def handle_favorites(self, request, pk=None):
-        return self._handle_recipe_relation(request, pk, FavoriteRecipe)
+        return self._handle_recipe_relation(request, FavoriteRecipe, pk)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite',
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    def bulk_favorites(self, request):
+        return self._handle_recipe_relation(request, FavoriteRecipe)
 
     @action(
         detail=True, 
@@ -149,21 +275,40 @@ class CookingRecipeViewSet(viewsets.ModelViewSet):
     )
     def get_link(self, request, pk=None):
 
-        recipe_exists = CookingRecipe.objects.filter(pk=pk).exists()
-        if not recipe_exists:
+        code = CookingRecipe.objects.filter(pk=pk).values_list('short_code', flat=True).first()
+        if code is None:
             return Response({'error': f'Рецепт с id={pk} не найден'}, status=status.HTTP_404_NOT_FOUND)
 
-        short_link = request.build_absolute_uri(reverse('recipes:short-link', kwargs={'pk': pk}))
+        short_link = request.build_absolute_uri(reverse('short-link', kwargs={'code': code}))
         return Response({'short-link': short_link})
 
 
-class UserViewSet(DjoserUserViewSet):
+class UserViewSet(ConditionalGetMixin, DjoserUserViewSet):
     
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = LimitOffsetPagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if self.action in ('list', 'retrieve') and user.is_authenticated:
+            queryset = queryset.annotate(is_subscribed=Exists(
+                UserSubscription.objects.filter(
+                    subscriber=user, target_user=OuterRef('pk')
+                )
+            ))
+        return queryset
+
+    def get_modification_state(self, request):
+        if self.action == 'list':
+            return self.list_state()
+        state = self.filter_lookup(self.get_queryset()).aggregate(
+            count=Count('pk'), users=Max('updated_at')
+        )
+        return state if state['count'] else None
+
     @action(
         detail=False, 
         methods=['get'], 
@@ -200,6 +345,7 @@ class UserViewSet(DjoserUserViewSet):
                 )
             
             if user_instance.avatar:
+                delete_derivatives(user_instance.avatar, AVATAR_SIZES)
                 user_instance.avatar.delete()
             
             serializer.save()
@@ -214,6 +360,7 @@ class UserViewSet(DjoserUserViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        delete_derivatives(user_instance.avatar, AVATAR_SIZES)
         user_instance.avatar.delete()
         user_instance.save()
         return Response(
@@ -229,13 +376,30 @@ class UserViewSet(DjoserUserViewSet):
     )
     def subscriptions(self, request):
         """Получить список подписок пользователя"""
-        subscribed_users = User.objects.filter(
-            authors__subscriber=request.user 
-        ).prefetch_related('recipes')
+        subscribed_users = self._with_limited_recipes(
+            User.objects
+            .filter(authors__subscriber=request.user)
+            .annotate(is_subscribed=Value(True))
+        )
         
         page = self.paginate_queryset(subscribed_users)
         serializer = UserSubscriptionSerializer(page, many=True, context={'request': request})
         return self.get_paginated_response(serializer.data)
+
+    def _with_limited_recipes(self, queryset):
+        """Подгружает не больше recipes_limit рецептов каждого автора
+        одним запросом с оконной функцией"""
+        query = SubscriptionQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        recipes = CookingRecipe.objects.only(
+            'id', 'title', 'picture', 'cook_duration', 'creator_id'
+        )
+        recipes_limit = query.validated_data.get('recipes_limit')
+        if recipes_limit is not None:
+            recipes = recipes[:recipes_limit]
+        return queryset.prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        )
         
     @action(
         detail=True, 
@@ -243,9 +407,9 @@ class UserViewSet(DjoserUserViewSet):
         url_path='subscribe',
         permission_classes=[permissions.IsAuthenticated]
     )
-    def subscribe(self, request, pk=None):
+    def subscribe(self, request, id=None):
         """Подписаться/отписаться от пользователя"""
-        target_user = get_object_or_404(User, pk=pk)
+        target_user = get_object_or_404(User, pk=id)
         
         if request.method == 'POST':
             if target_user == request.user:
@@ -264,6 +428,9 @@ class UserViewSet(DjoserUserViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
+            target_user = self._with_limited_recipes(
+                User.objects.filter(pk=target_user.pk)
+            ).get()
             serializer = UserSubscriptionSerializer(target_user, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         
@@ -274,3 +441,10 @@ class UserViewSet(DjoserUserViewSet):
         )
         subscription.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def cache_stats(request):
+    """Статистика попаданий в кэш ответов"""
+    return Response(get_stats())
@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+# Постоянные соединения не переиспользуются между ASGI-запросами,
+# для этого есть DB_CONNECTION_MODE=pool или pgbouncer.
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'api.apps.ApiConfig',
     'recipes.apps.RecipesConfig',
     'django_filters',
@@ -54,8 +55,32 @@ INSTALLED_APPS = [
 
 DJANGO_SHORT_URL_REDIRECT_URL = ''
 
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+INGREDIENT_INDEX_MAX_AGE = int(os.getenv('INGREDIENT_INDEX_MAX_AGE', 300))
+COMPONENT_INDEX_MAX_AGE = int(os.getenv('COMPONENT_INDEX_MAX_AGE', 300))
+COMPONENT_FILTER_LIMIT = int(os.getenv('COMPONENT_FILTER_LIMIT', 10000))
+# Индексы продуктов разных процессов догоняют друг друга по журналу
+# изменений в кэше: нужен общий CACHE_BACKEND (Redis, Memcached).
+COMPONENT_INDEX_LOG_LIMIT = int(os.getenv('COMPONENT_INDEX_LOG_LIMIT', 10000))
+COMPONENT_INDEX_LOG_TIMEOUT = int(os.getenv('COMPONENT_INDEX_LOG_TIMEOUT', 60 * 60))
+
+SHORT_LINK_INDEX_MAX_AGE = int(os.getenv('SHORT_LINK_INDEX_MAX_AGE', 600))
+SHORT_LINK_CACHE_SIZE = int(os.getenv('SHORT_LINK_CACHE_SIZE', 10000))
+SHORT_LINK_REFRESH_INTERVAL = float(os.getenv('SHORT_LINK_REFRESH_INTERVAL', 1))
+SHORT_LINK_HITS_BATCH = int(os.getenv('SHORT_LINK_HITS_BATCH', 100))
+SHORT_LINK_HITS_FLUSH_INTERVAL = int(os.getenv('SHORT_LINK_HITS_FLUSH_INTERVAL', 10))
+
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+FEED_BACKFILL_LIMIT = int(os.getenv('FEED_BACKFILL_LIMIT', 100))
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.metrics.MetricsMiddleware',
+    'api.nplusone.NPlusOneMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -97,9 +122,60 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
         'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+}
+
+# persistent — соединение живёт CONN_MAX_AGE секунд в потоке воркера;
+# pool — пул psycopg 3 (нужен psycopg[pool]), подходит для WSGI и ASGI;
+# pgbouncer — PgBouncer в режиме transaction: без серверных курсоров
+# и подготовленных выражений.
+DB_CONNECTION_MODE = os.getenv('DB_CONNECTION_MODE', 'persistent')
+if DB_CONNECTION_MODE == 'pool':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 10 * 60)),
+    }
+elif DB_CONNECTION_MODE == 'pgbouncer':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+    try:
+        import psycopg  # noqa: F401
+    except ImportError:
+        # psycopg2 подставляет параметры на клиенте и не готовит выражения.
+        pass
+    else:
+        DATABASES['default']['OPTIONS']['prepare_threshold'] = None
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
     }
 }
 
+API_CACHE_TIMEOUT = int(os.getenv('API_CACHE_TIMEOUT', 60 * 60))
+
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 5 * 60))
+
+# Асинхронные представления частых запросов на чтение, для ASGI.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+
+# Server-Timing раскрывает клиентам число и время SQL-запросов.
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', str(DEBUG)) == 'True'
+# /metrics доступен персоналу и по заголовку Authorization: Bearer <токен>.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+NPLUSONE_ENABLED = os.getenv('NPLUSONE_ENABLED', str(DEBUG)) == 'True'
+NPLUSONE_RAISE = os.getenv('NPLUSONE_RAISE', 'False') == 'True'
+NPLUSONE_THRESHOLD = int(os.getenv('NPLUSONE_THRESHOLD', 3))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -152,6 +228,15 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'collected_static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'recipes.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -164,7 +249,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
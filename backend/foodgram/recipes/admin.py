@@ -1,7 +1,13 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Count, Q
+from django.utils.functional import cached_property
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
+from .images import derivative_url
 from .models import (
     CookingRecipe, ProductComponent, RecipeComponent, 
     FavoriteRecipe, ShoppingCart, User, UserSubscription
@@ -9,20 +15,41 @@ from .models import (
 
 
 
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, берущий число строк нефильтрованной таблицы
+    из статистики PostgreSQL вместо COUNT(*)"""
+
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] > self.exact_count_threshold:
+                return int(row[0])
+        return super().count
+
+
 class BaseHasRelatedFilter(admin.SimpleListFilter):
     title = ''
     parameter_name = ''
     lookups_choices = ()
-    related_field = ''
+    count_field = ''
 
     def lookups(self, request, model_admin):
         return self.lookups_choices
 
     def queryset(self, request, queryset):
         if self.value() == 'yes':
-            return queryset.filter(**{f'{self.related_field}__isnull': False}).distinct()
+            return queryset.filter(**{f'{self.count_field}__gt': 0})
         if self.value() == 'no':
-            return queryset.filter(**{f'{self.related_field}__isnull': True}).distinct()
+            return queryset.filter(**{self.count_field: 0})
 
 
 class HasRecipesFilter(BaseHasRelatedFilter):
@@ -32,7 +59,7 @@ class HasRecipesFilter(BaseHasRelatedFilter):
         ('yes', _('Есть рецепты')),
         ('no', _('Нет рецептов')),
     )
-    related_field = 'recipes'
+    count_field = 'recipes_count'
 
 
 class HasSubscriptionsFilter(BaseHasRelatedFilter):
@@ -42,7 +69,7 @@ class HasSubscriptionsFilter(BaseHasRelatedFilter):
         ('yes', _('Есть подписки')),
         ('no', _('Нет подписок')),
     )
-    related_field = 'following'
+    count_field = 'subscriptions_count'
 
 
 class HasSubscribersFilter(BaseHasRelatedFilter):
@@ -52,7 +79,7 @@ class HasSubscribersFilter(BaseHasRelatedFilter):
         ('yes', _('Есть подписчики')),
         ('no', _('Нет подписчиков')),
     )
-    related_field = 'followers'
+    count_field = 'subscribers_count'
 
 
 @admin.register(User)
@@ -69,42 +96,25 @@ class FoodgramUserAdmin(UserAdmin):
         HasRecipesFilter, HasSubscriptionsFilter, HasSubscribersFilter
     )
     ordering = ('username',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     readonly_fields = (
         'date_joined', 'last_login', 'recipes_count', 
         'subscribers_count', 'subscriptions_count', 'get_avatar'
     )
     
-    def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related(
-            'recipes', 'following', 'followers'
-        )
-    
     @admin.display(description=_('ФИО'), ordering='first_name')
     def get_full_name(self, user):
         """ФИО пользователя"""
         return f"{user.first_name} {user.last_name}".strip()
     
-    @admin.display(description=_('рецептов'), ordering='recipes')
-    def recipes_count(self, user):
-        """Количество рецептов пользователя"""
-        return user.recipes.count()
-    
-    @admin.display(description=_('Подписчиков'), ordering='followers')
-    def subscribers_count(self, user):
-        """Количество подписчиков"""
-        return user.followers.count()
-    
-    @admin.display(description=_('Подписок'), ordering='following')
-    def subscriptions_count(self, user):
-        """Количество подписок"""
-        return user.following.count()
-    
     @admin.display(description=_('Аватар'))
     def get_avatar(self, user):
         """Отображение аватара в админке"""
         if user.avatar:
             return mark_safe(
-                f'<img src="{user.avatar.url}" width="50" height="50" style="border-radius: 50%;" />'
+                f'<img src="{derivative_url(user.avatar, "avatar", "jpeg")}" '
+                'width="50" height="50" style="border-radius: 50%;" />'
             )
         return _('Нет аватара')
 
@@ -121,7 +131,11 @@ class UserSubscriptionAdmin(admin.ModelAdmin):
         'subscriber__username', 'target_user__username'
     )
     list_filter = ('subscriber', 'target_user')
+    list_select_related = ('subscriber', 'target_user')
+    autocomplete_fields = ('subscriber', 'target_user')
     ordering = ('subscriber',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     @admin.display(description=_('Email подписчика'), ordering='subscriber__email')
     def get_subscriber_email(self, obj):
@@ -136,8 +150,7 @@ class UserSubscriptionAdmin(admin.ModelAdmin):
     @admin.display(description=_('Рецептов у автора'))
     def get_subscription_info(self, obj):
         """Дополнительная информация о подписке"""
-        target_recipes = obj.target_user.authored_recipes.count()
-        return f"{target_recipes} {_('рецептов')}"
+        return f"{obj.target_user.recipes_count} {_('рецептов')}"
 
 class HasInRecipesFilter(BaseHasRelatedFilter):
     title = _('наличие в рецептах')
@@ -146,20 +159,15 @@ class HasInRecipesFilter(BaseHasRelatedFilter):
         ('yes', _('Есть в рецептах')),
         ('no', _('Нет в рецептах')),
     )
-    related_field = 'recipe_components'
+    count_field = 'recipes_count'
 
 @admin.register(ProductComponent)
 class ProductComponentAdmin(admin.ModelAdmin):
     
-    list_display = ('title', 'unit_type', 'recipe_count')
+    list_display = ('title', 'unit_type', 'recipes_count')
     search_fields = ('title', 'unit_type')
     list_filter = ('unit_type', HasInRecipesFilter)
     ordering = ('title',)
-    
-    @admin.display(description=_('Количество рецептов'))
-    def recipe_count(self, obj):
-        """Количество рецептов с этим ингредиентом"""
-        return obj.recipe_components.count()
 
 
 @admin.register(CookingRecipe)
@@ -171,30 +179,42 @@ class CookingRecipeAdmin(admin.ModelAdmin):
     )
     search_fields = ('title', 'creator__email', 'creator__username')
     list_filter = ('creator', 'date_created')
+    list_select_related = ('creator',)
     ordering = ('-date_created',)
-    readonly_fields = ('date_created', 'get_ingredients', 'get_image', 'favorites_count')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = (
+        'date_created', 'get_ingredients', 'get_image', 'favorites_count',
+        'short_code', 'short_link_hits'
+    )
+
+    def get_queryset(self, request):
+        return (
+            super().get_queryset(request)
+            .defer('search_vector')
+            .prefetch_related('recipe_components__component')
+        )
     
     @admin.display(description=_('Продукты'))
     def get_ingredients(self, obj):
         """Отображение продуктов в админке"""
         return mark_safe("<br>".join(
             f"{ingredient.component.title} - {ingredient.quantity} {ingredient.component.unit_type}"
-            for ingredient in obj.recipe_components.select_related('component')
+            for ingredient in obj.recipe_components.all()
         ))
     
     @admin.display(description=_('Изображение'))
     def get_image(self, obj):
         """Отображение картинки в админке"""
         if obj.picture:
-            return mark_safe(
-                f'<img src="{obj.picture.url}" width="50" height="50" style="border-radius: 5px;" />'
+            # Копия может быть ещё не создана: тогда браузер покажет
+            # оригинал, хранилище на каждой строке не опрашивается.
+            return format_html(
+                '<img src="{}" onerror="this.onerror=null;this.src=\'{}\'" '
+                'width="50" height="50" style="border-radius: 5px;" />',
+                derivative_url(obj.picture, 'card', 'jpeg'), obj.picture.url
             )
         return _('Нет изображения')
-    
-    @admin.display(description=_('В избранном'), ordering='favorite_recipes')
-    def favorites_count(self, obj):
-        """Количество добавлений в избранное"""
-        return obj.favorite_recipes.count()
 
 
 @admin.register(RecipeComponent)
@@ -203,7 +223,10 @@ class RecipeComponentAdmin(admin.ModelAdmin):
     list_display = ('recipe', 'component', 'quantity')
     search_fields = ('recipe__title', 'component__title')
     list_filter = ('recipe', 'component')
+    list_select_related = ('recipe', 'component')
     ordering = ('recipe',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(FavoriteRecipe)
@@ -212,7 +235,10 @@ class FavoriteRecipeAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe', 'get_recipe_title')
     search_fields = ('user__email', 'user__username', 'recipe__title')
     list_filter = ('recipe__creator', 'recipe__date_created')
+    list_select_related = ('user', 'recipe')
     ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     @admin.display(description=_('Название рецепта'), ordering='recipe__title')
     def get_recipe_title(self, obj):
@@ -226,7 +252,10 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe', 'get_recipe_title', 'get_recipe_author')
     search_fields = ('user__email', 'user__username', 'recipe__title')
     list_filter = ('recipe__creator', 'recipe__date_created')
+    list_select_related = ('user', 'recipe__creator')
     ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     @admin.display(description=_('Название рецепта'), ordering='recipe__title')
     def get_recipe_title(self, obj):
@@ -244,13 +273,13 @@ class CustomAdminSite(admin.AdminSite):
         extra_context = extra_context or {}
         
   
-        recipe_stats = {
-            'total_recipes': CookingRecipe.objects.count(),
-            'total_users': User.objects.count(),
-            'total_ingredients': ProductComponent.objects.count(),
-            'recipes_in_favorites': FavoriteRecipe.objects.values('recipe').distinct().count(),
-            'recipes_in_carts': ShoppingCart.objects.values('recipe').distinct().count(),
-        }
+        recipe_stats = CookingRecipe.objects.aggregate(
+            total_recipes=Count('pk'),
+            recipes_in_favorites=Count('pk', filter=Q(favorites_count__gt=0)),
+            recipes_in_carts=Count('pk', filter=Q(shopping_cart_count__gt=0)),
+        )
+        recipe_stats['total_users'] = User.objects.count()
+        recipe_stats['total_ingredients'] = ProductComponent.objects.count()
         
         extra_context['recipe_stats'] = recipe_stats
         return super().index(request, extra_context)
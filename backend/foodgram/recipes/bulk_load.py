@@ -0,0 +1,134 @@
+import csv
+import json
+from io import StringIO
+from itertools import islice
+
+from django.db import connection
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_batches(iterable, size):
+    """Разбивает поток на списки не длиннее size"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_json_array(file, chunk_size=READ_CHUNK_SIZE):
+    """Разбирает JSON-массив по одному элементу, читая файл кусками.
+
+    В памяти держится только текущий кусок и недочитанный элемент,
+    поэтому размер файла не ограничен объёмом памяти.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    started = False
+
+    def skip_whitespace():
+        nonlocal position
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+
+    def read_more():
+        nonlocal buffer, position, eof
+        chunk = file.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        eof = not chunk
+
+    while True:
+        skip_whitespace()
+        if position >= len(buffer):
+            if eof:
+                raise ValueError('Неожиданный конец JSON-массива')
+            read_more()
+            continue
+        char = buffer[position]
+        if not started:
+            if char != '[':
+                raise ValueError('Ожидался JSON-массив')
+            started = True
+            position += 1
+            continue
+        if char == ']':
+            return
+        if char == ',':
+            position += 1
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            read_more()
+            continue
+        if end == len(buffer) and not eof:
+            # Число на границе куска может быть прочитано не целиком.
+            read_more()
+            continue
+        position = end
+        yield item
+
+
+def iter_csv_rows(file):
+    for row in csv.reader(file):
+        if row:
+            yield row
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Загружает строки в таблицу PostgreSQL через COPY FROM STDIN"""
+    buffer = StringIO()
+    csv.writer(buffer).writerows(rows)
+    sql = f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)'
+    if hasattr(cursor, 'copy_expert'):
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+        return
+    # psycopg 3, который использует режим пула.
+    with cursor.copy(sql) as copy:
+        copy.write(buffer.getvalue())
+
+
+def insert_returning(model, fields, rows, returning):
+    """Вставляет строки, пропуская конфликтующие, и возвращает значения
+    поля returning только действительно вставленных строк.
+
+    bulk_create(ignore_conflicts=True) не сообщает, какие строки
+    вставлены, а при параллельных запросах это нужно для счётчиков.
+    Использует INSERT ... ON CONFLICT DO NOTHING RETURNING (PostgreSQL,
+    SQLite 3.35+).
+    """
+    if not rows:
+        return []
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+    placeholders = ', '.join([f'({", ".join(["%s"] * len(fields))})'] * len(rows))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(model._meta.db_table)} ({columns}) '
+            f'VALUES {placeholders} ON CONFLICT DO NOTHING '
+            f'RETURNING {quote(model._meta.get_field(returning).column)}',
+            [value for row in rows for value in row]
+        )
+        return [value for value, in cursor.fetchall()]
+
+
+def delete_returning(queryset, returning):
+    """Удаляет строки queryset одним запросом без сигналов и возвращает
+    значения поля returning действительно удалённых строк"""
+    model = queryset.model
+    quote = connection.ops.quote_name
+    pk_column = quote(model._meta.pk.column)
+    subquery, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} '
+            f'WHERE {pk_column} IN ({subquery}) '
+            f'RETURNING {quote(model._meta.get_field(returning).column)}',
+            params
+        )
+        return [value for value, in cursor.fetchall()]
@@ -0,0 +1,363 @@
+from array import array
+from bisect import bisect_left, insort
+from functools import reduce
+from itertools import repeat
+from operator import and_, or_
+from threading import Lock, Thread
+from time import monotonic, time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import RecipeComponent
+
+VERSION_KEY = 'recipes:component_index:version'
+LOG_KEY = 'recipes:component_index:log:{}'
+EMPTY = array('I')
+# Список длиннее 1/32 числа рецептов занимает больше места, чем битовая
+# карта: такие продукты хранятся картой.
+DENSE_RATIO = 32
+
+
+def get_version():
+    """Общая для процессов версия продуктов рецептов.
+
+    Если ключ вытеснен из кэша, начинаем с метки времени, чтобы
+    не вернуться к номеру, под которым построен устаревший индекс.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, int(time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def contains(recipes, recipe_id):
+    if isinstance(recipes, int):
+        return bool(recipes >> recipe_id & 1)
+    index = bisect_left(recipes, recipe_id)
+    return index < len(recipes) and recipes[index] == recipe_id
+
+
+def to_bitmap(recipes):
+    """Битовая карта (int) из отсортированного массива id"""
+    if isinstance(recipes, int):
+        return recipes
+    if not recipes:
+        return 0
+    bits = bytearray(recipes[-1] // 8 + 1)
+    for recipe_id in recipes:
+        bits[recipe_id >> 3] |= 1 << (recipe_id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def iter_bits(bitmap, reverse=False):
+    """Номера установленных битов по возрастанию или убыванию"""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    indexes = range(len(data) - 1, -1, -1) if reverse else range(len(data))
+    for index in indexes:
+        byte = data[index]
+        while byte:
+            bit = byte.bit_length() - 1 if reverse else (byte & -byte).bit_length() - 1
+            yield index * 8 + bit
+            byte ^= 1 << bit
+
+
+class Ranking:
+    """Последовательность (id, есть продуктов, всего продуктов) для
+    пагинации DRF. Рецепты с одинаковым числом имеющихся и всех
+    продуктов хранятся одной картой, id извлекаются только для среза."""
+
+    def __init__(self, groups):
+        self.groups = groups
+
+    def __len__(self):
+        return sum(count for *_, count in self.groups)
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(len(self))
+        page = []
+        for matched, total, bitmap, count in self.groups:
+            if start < count:
+                for index, recipe_id in enumerate(iter_bits(bitmap, reverse=True)):
+                    if index >= stop:
+                        break
+                    if index >= start:
+                        page.append((recipe_id, matched, total))
+            if stop <= count:
+                break
+            start, stop = max(start - count, 0), stop - count
+        return page
+
+
+class ComponentIndex:
+    """Обратный индекс продукт → рецепты в памяти процесса.
+
+    Редкие продукты хранят отсортированный массив id рецептов, частые —
+    битовую карту в int, поэтому индекс занимает не больше 4 байт
+    на продукт рецепта. Пересечения, исключения и подсчёт совпадений
+    выполняются побитовыми операциями над картами: время запроса
+    зависит от числа продуктов в нём и наибольшего id рецепта,
+    а не от длины списков.
+
+    Индекс строится при первом обращении и обновляется сигналами
+    и сериализатором рецепта. Каждая зафиксированная запись получает
+    номер общей версии в кэше и попадает в журнал под этим номером;
+    отставший индекс другого процесса применяет записи журнала перед
+    запросом, не перечитывая таблицу. Если журнала не хватает
+    (больше ``log_limit`` записей или запись вытеснена) или индексу
+    больше ``max_age`` секунд, он перестраивается в фоновом потоке,
+    а запросы до конца перестройки обслуживает прежнее состояние.
+    Для общей версии нужен общий кэш (Redis, Memcached): с кэшем
+    в памяти процесса (LocMemCache) изменения других процессов видны
+    только после фоновой перестройки.
+
+    Запросы читают состояние без блокировки: запись подменяет словари
+    новыми копиями целиком. Массив ``sizes`` меняется на месте, его
+    читает только запись под блокировкой.
+    """
+
+    def __init__(self, max_age=None, log_limit=None, log_timeout=None):
+        self.max_age = max_age
+        self.log_limit = log_limit
+        self.log_timeout = log_timeout
+        self._lock = Lock()
+        self._state = None
+        self._rebuilding = False
+
+    def invalidate(self):
+        """Сбрасывает индекс этого процесса: он построится заново
+        при следующем обращении"""
+        self._state = None
+
+    def reset(self):
+        """Сбрасывает индексы всех процессов после записи в обход
+        сигналов: общая версия начинается заново, журнал не покрывает
+        разрыв, и индексы перестраиваются в фоне"""
+        cache.delete(VERSION_KEY)
+        self._state = None
+
+    def add(self, recipe_id, component_ids):
+        component_ids = list(component_ids)
+        self._update(recipe_id, component_ids, 1)
+        self._publish((1, recipe_id, component_ids))
+
+    def remove(self, recipe_id, component_ids):
+        component_ids = list(component_ids)
+        self._update(recipe_id, component_ids, -1)
+        self._publish((-1, recipe_id, component_ids))
+
+    def reload(self, recipe_id):
+        """Перечитывает продукты рецепта, когда прежний продукт
+        изменённой записи неизвестен"""
+        with self._lock:
+            if self._state is not None:
+                self._state = self._reload(self._state, recipe_id)
+        self._publish((0, recipe_id, None))
+
+    def recipes_with_all(self, component_ids, exclude=(), limit=None):
+        """Отсортированные id рецептов со всеми продуктами component_ids
+        и без продуктов exclude; None, если их больше limit"""
+        postings = self._get_state()[0]
+        bitmap = reduce(and_, (
+            to_bitmap(postings.get(component_id, EMPTY))
+            for component_id in set(component_ids)
+        ))
+        bitmap &= ~reduce(or_, (
+            to_bitmap(postings.get(component_id, EMPTY))
+            for component_id in set(exclude)
+        ), 0)
+        if limit is not None and bitmap.bit_count() > limit:
+            return None
+        return list(iter_bits(bitmap))
+
+    def rank(self, component_ids, min_coverage=0):
+        """Рецепты, которые можно приготовить из продуктов component_ids:
+        сначала с большей долей имеющихся продуктов, затем с большим
+        их числом, затем новые"""
+        postings, _, size_bitmaps = self._get_state()
+        # Число совпадений рецепта в двоичной записи: бит i хранится
+        # в planes[i], списки складываются побитовым сумматором.
+        planes = []
+        for component_id in set(component_ids):
+            carry = to_bitmap(postings.get(component_id, EMPTY))
+            for index, plane in enumerate(planes):
+                planes[index], carry = plane ^ carry, plane & carry
+            if carry:
+                planes.append(carry)
+        groups = []
+        for total, size_bitmap in list(size_bitmaps.items()):
+            for matched in range(1, min(total, 2 ** len(planes) - 1) + 1):
+                if matched < min_coverage * total:
+                    continue
+                bitmap = size_bitmap
+                for index, plane in enumerate(planes):
+                    bitmap &= plane if matched >> index & 1 else ~plane
+                count = bitmap.bit_count()
+                if count:
+                    groups.append((matched, total, bitmap, count))
+        groups.sort(key=lambda group: (group[0] / group[1], group[0]), reverse=True)
+        return Ranking(groups)
+
+    def _update(self, recipe_id, component_ids, delta):
+        with self._lock:
+            if self._state is not None:
+                self._state = self._apply(self._state, recipe_id, component_ids, delta)
+
+    def _apply(self, state, recipe_id, component_ids, delta):
+        """Новое состояние с рецептом, добавленным к продуктам
+        или убранным из них. Повторное применение ничего не меняет."""
+        built_at, version, postings, sizes, size_bitmaps = state
+        postings = dict(postings)
+        if recipe_id >= len(sizes):
+            sizes.extend(repeat(0, recipe_id + 1 - len(sizes)))
+        bit = 1 << recipe_id
+        size = sizes[recipe_id]
+        for component_id in component_ids:
+            recipes = postings.get(component_id, EMPTY)
+            if contains(recipes, recipe_id) == (delta > 0):
+                continue
+            if isinstance(recipes, int):
+                postings[component_id] = recipes ^ bit
+            elif delta > 0:
+                recipes = array('I', recipes)
+                insort(recipes, recipe_id)
+                postings[component_id] = recipes
+            else:
+                index = bisect_left(recipes, recipe_id)
+                postings[component_id] = recipes[:index] + recipes[index + 1:]
+            size += delta
+        if size != sizes[recipe_id]:
+            size_bitmaps = dict(size_bitmaps)
+            if sizes[recipe_id]:
+                size_bitmaps[sizes[recipe_id]] &= ~bit
+            if size:
+                size_bitmaps[size] = size_bitmaps.get(size, 0) | bit
+            sizes[recipe_id] = size
+        return (built_at, version, postings, sizes, size_bitmaps)
+
+    def _reload(self, state, recipe_id):
+        current = set(
+            RecipeComponent.objects.filter(recipe_id=recipe_id)
+            .values_list('component_id', flat=True)
+        )
+        indexed = {
+            component_id for component_id, recipes in state[2].items()
+            if contains(recipes, recipe_id)
+        }
+        state = self._apply(state, recipe_id, indexed - current, -1)
+        return self._apply(state, recipe_id, current - indexed, 1)
+
+    def _publish(self, entry):
+        """Записывает изменение в журнал после фиксации транзакции"""
+        transaction.on_commit(lambda: self._log(entry))
+
+    def _log(self, entry):
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            # Версия вытеснена: get_version начнёт новую, и индексы
+            # перестроятся.
+            return
+        cache.set(LOG_KEY.format(version), entry, self.log_timeout)
+
+    def _get_state(self):
+        state = self._state
+        if state is None:
+            with self._lock:
+                if self._state is None:
+                    version = get_version()
+                    self._state = (monotonic(), version, *self._build())
+                state = self._state
+        else:
+            state = self._catch_up(state)
+            if monotonic() - state[0] > self.max_age:
+                self._rebuild_in_background()
+        return state[2:]
+
+    def _catch_up(self, state):
+        """Применяет записи журнала после версии индекса; при пропуске
+        в журнале оставляет индекс на последней применённой версии"""
+        version = get_version()
+        if version == state[1]:
+            return state
+        if not state[1] < version <= state[1] + self.log_limit:
+            self._rebuild_in_background()
+            return state
+        entries = cache.get_many([
+            LOG_KEY.format(number) for number in range(state[1] + 1, version + 1)
+        ])
+        with self._lock:
+            if self._state is None:
+                return state
+            state = self._state
+            for number in range(state[1] + 1, version + 1):
+                entry = entries.get(LOG_KEY.format(number))
+                if entry is None:
+                    break
+                delta, recipe_id, component_ids = entry
+                if delta:
+                    state = self._apply(state, recipe_id, component_ids, delta)
+                else:
+                    state = self._reload(state, recipe_id)
+                state = (state[0], number, *state[2:])
+            self._state = state
+        return state
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        Thread(target=self._rebuild, daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            # Записи после этой версии, уже попавшие в таблицу, журнал
+            # применит повторно без изменений.
+            version = get_version()
+            built = self._build()
+            with self._lock:
+                self._state = (monotonic(), version, *built)
+        finally:
+            self._rebuilding = False
+            connection.close()
+
+    def _build(self):
+        postings = {}
+        sizes = array('H')
+        rows = (
+            RecipeComponent.objects
+            .order_by('component_id', 'recipe_id')
+            .values_list('component_id', 'recipe_id')
+        )
+        current = None
+        for component_id, recipe_id in rows.iterator(chunk_size=10000):
+            if component_id != current:
+                current = component_id
+                recipes = postings[component_id] = array('I')
+            recipes.append(recipe_id)
+            if recipe_id >= len(sizes):
+                sizes.extend(repeat(0, max(recipe_id + 1 - len(sizes), len(sizes))))
+            sizes[recipe_id] += 1
+        for component_id, recipes in postings.items():
+            if len(recipes) * DENSE_RATIO > len(sizes):
+                postings[component_id] = to_bitmap(recipes)
+        size_bits = {}
+        for recipe_id, size in enumerate(sizes):
+            if size:
+                if size not in size_bits:
+                    size_bits[size] = bytearray(len(sizes) // 8 + 1)
+                size_bits[size][recipe_id >> 3] |= 1 << (recipe_id & 7)
+        size_bitmaps = {
+            size: int.from_bytes(bits, 'little') for size, bits in size_bits.items()
+        }
+        return postings, sizes, size_bitmaps
+
+
+component_index = ComponentIndex(
+    max_age=getattr(settings, 'COMPONENT_INDEX_MAX_AGE', 300),
+    log_limit=getattr(settings, 'COMPONENT_INDEX_LOG_LIMIT', 10000),
+    log_timeout=getattr(settings, 'COMPONENT_INDEX_LOG_TIMEOUT', 3600),
+)
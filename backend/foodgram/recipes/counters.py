@@ -0,0 +1,61 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import (
+    CookingRecipe, FavoriteRecipe, ProductComponent, RecipeComponent,
+    ShoppingCart, User, UserSubscription
+)
+
+COUNTERS = (
+    (CookingRecipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (CookingRecipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', CookingRecipe, 'creator'),
+    (User, 'subscribers_count', UserSubscription, 'target_user'),
+    (User, 'subscriptions_count', UserSubscription, 'subscriber'),
+    (ProductComponent, 'recipes_count', RecipeComponent, 'component'),
+)
+
+
+def shift_counter(model, pks, field, delta):
+    """Атомарно изменяет счётчик на delta для объектов с указанными pk"""
+    return model.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+
+def shift_related_counters(related_model, related_field, pks, delta):
+    """Изменяет счётчики строк related_model у объектов pks.
+
+    Нужна для bulk_create и удаления без сигналов, где счётчики
+    не обновляются обработчиками post_save и post_delete.
+    """
+    for model, field, counted_model, counted_field in COUNTERS:
+        if counted_model is related_model and counted_field == related_field:
+            shift_counter(model, pks, field, delta)
+
+
+def actual_count(related_model, related_field):
+    return Coalesce(
+        Subquery(
+            related_model.objects
+            .filter(**{related_field: OuterRef('pk')})
+            .order_by()
+            .values(related_field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        Value(0)
+    )
+
+
+def reconcile_counters():
+    """Пересчитывает разошедшиеся счётчики, возвращает число исправлений
+    по каждому счётчику"""
+    fixed = {}
+    for model, field, related_model, related_field in COUNTERS:
+        count = actual_count(related_model, related_field)
+        fixed[f'{model._meta.model_name}.{field}'] = (
+            model.objects
+            .annotate(actual=count)
+            .exclude(**{field: F('actual')})
+            .update(**{field: count})
+        )
+    return fixed
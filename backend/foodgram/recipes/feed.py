@@ -0,0 +1,141 @@
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db.models import Q
+
+from .bulk_load import iter_batches
+from .models import CookingRecipe, FeedEntry, User, UserSubscription
+
+BATCH_SIZE = 1000
+
+
+def is_celebrity(subscribers_count):
+    """Рецепты авторов с большим числом подписчиков не раскладываются
+    по лентам при публикации, а подмешиваются при чтении"""
+    return subscribers_count >= settings.FEED_FANOUT_LIMIT
+
+
+def get_subscribers_count(author_id):
+    return User.objects.values_list('subscribers_count', flat=True).get(pk=author_id)
+
+
+def write_entries(subscriber_ids, recipes):
+    return len(FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(user_id=subscriber_id, recipe_id=pk, date_created=date_created)
+            for subscriber_id in subscriber_ids
+            for pk, date_created in recipes
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    ))
+
+
+def subscriber_ids(author_id):
+    return (
+        UserSubscription.objects
+        .filter(target_user_id=author_id)
+        .values_list('subscriber_id', flat=True)
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+
+
+def fan_out_recipe(recipe):
+    """Записывает новый рецепт в ленты подписчиков автора"""
+    if is_celebrity(get_subscribers_count(recipe.creator_id)):
+        return 0
+    return write_entries(
+        subscriber_ids(recipe.creator_id), [(recipe.pk, recipe.date_created)]
+    )
+
+
+def backfill_feed(author_id, subscriber_ids):
+    """Добавляет в ленты подписчиков последние рецепты автора"""
+    recipes = list(
+        CookingRecipe.objects
+        .filter(creator_id=author_id)
+        .order_by('-date_created', '-id')
+        .values_list('pk', 'date_created')[:settings.FEED_BACKFILL_LIMIT]
+    )
+    return write_entries(subscriber_ids, recipes)
+
+
+def subscribe_feed(subscriber_id, author_id):
+    if not is_celebrity(get_subscribers_count(author_id)):
+        backfill_feed(author_id, [subscriber_id])
+
+
+def unsubscribe_feed(subscriber_id, author_id):
+    """Убирает рецепты автора из ленты отписавшегося пользователя.
+
+    Если автор перестал быть знаменитостью, его рецепты больше
+    не подмешиваются при чтении, поэтому они раскладываются по лентам
+    оставшихся подписчиков.
+    """
+    FeedEntry.objects.filter(
+        user_id=subscriber_id, recipe__creator_id=author_id
+    ).delete()
+    if get_subscribers_count(author_id) == settings.FEED_FANOUT_LIMIT - 1:
+        backfill_feed(author_id, subscriber_ids(author_id))
+
+
+def after_position(queryset, position, pk_field):
+    if position is None:
+        return queryset
+    date_created, pk = position
+    return queryset.filter(
+        Q(date_created__lt=date_created)
+        | Q(date_created=date_created, **{f'{pk_field}__lt': pk})
+    )
+
+
+def get_feed_page(user, position, limit):
+    """Позиции (date_created, id рецепта) ленты пользователя после position.
+
+    Записи ленты читаются диапазоном по индексу, рецепты знаменитостей
+    из подписок добавляются отдельным запросом и сливаются с ними.
+    """
+    entries = after_position(
+        FeedEntry.objects.filter(user=user), position, 'recipe_id'
+    ).order_by('-date_created', '-recipe_id').values_list('date_created', 'recipe_id')
+    celebrities = UserSubscription.objects.filter(
+        subscriber=user,
+        target_user__subscribers_count__gte=settings.FEED_FANOUT_LIMIT
+    ).values('target_user')
+    pulled = after_position(
+        CookingRecipe.objects.filter(creator__in=celebrities), position, 'pk'
+    ).order_by('-date_created', '-id').values_list('date_created', 'pk')
+    return sorted(set(entries[:limit]) | set(pulled[:limit]), reverse=True)[:limit]
+
+
+def rebuild_feeds(user_ids=None):
+    """Заполняет ленты заново по текущим подпискам, например после
+    массовой загрузки в обход сигналов: все ленты или только ленты
+    пользователей user_ids. Нужны актуальные счётчики подписчиков."""
+    if user_ids is None:
+        FeedEntry.objects.all().delete()
+        authors = list(
+            User.objects
+            .filter(subscribers_count__gt=0, subscribers_count__lt=settings.FEED_FANOUT_LIMIT)
+            .values_list('pk', flat=True)
+        )
+        return sum(
+            backfill_feed(author_id, list(subscriber_ids(author_id)))
+            for author_id in authors
+        )
+    written = 0
+    for batch in iter_batches(user_ids, BATCH_SIZE):
+        FeedEntry.objects.filter(user_id__in=batch).delete()
+        subscriptions = (
+            UserSubscription.objects
+            .filter(
+                subscriber_id__in=batch,
+                target_user__subscribers_count__lt=settings.FEED_FANOUT_LIMIT
+            )
+            .order_by('target_user_id')
+            .values_list('target_user_id', 'subscriber_id')
+        )
+        for author_id, rows in groupby(subscriptions, itemgetter(0)):
+            written += backfill_feed(author_id, [subscriber for _, subscriber in rows])
+    return written
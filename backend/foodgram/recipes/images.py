@@ -0,0 +1,122 @@
+import posixpath
+from functools import lru_cache
+from hashlib import sha256
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image
+
+RECIPE_PICTURE_SIZES = {
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
+AVATAR_SIZES = {
+    'avatar': (160, 160),
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+SIZES = {**RECIPE_PICTURE_SIZES, **AVATAR_SIZES}
+
+
+@lru_cache(maxsize=None)
+def spec_tag(size, extension):
+    """Короткий хэш размера и параметров кодирования копии"""
+    spec = repr((SIZES[size], sorted(FORMATS[extension].items())))
+    return sha256(spec.encode()).hexdigest()[:8]
+
+
+def derivative_name(name, size, extension):
+    """Имя производного изображения рядом с оригиналом:
+    recipes/images/abc.png -> recipes/images/derivatives/abc_card.1f2e3d4c.webp.
+
+    Оригиналы названы по содержимому, а хэш параметров меняет имя
+    копии при изменении размеров или качества, поэтому URL копий
+    можно кэшировать бессрочно."""
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(
+        directory, 'derivatives',
+        f'{stem}_{size}.{spec_tag(size, extension)}.{extension}'
+    )
+
+
+def iter_derivative_names(image, sizes):
+    for size in sizes:
+        for extension in FORMATS:
+            yield size, extension, derivative_name(image.name, size, extension)
+
+
+def generate_derivatives(image, sizes, force=False):
+    """Сохраняет уменьшенные копии изображения в WebP и JPEG,
+    возвращает число созданных файлов"""
+    if not image:
+        return 0
+    storage = image.storage
+    missing = [
+        (size, extension, name)
+        for size, extension, name in iter_derivative_names(image, sizes)
+        if force or not storage.exists(name)
+    ]
+    if not missing:
+        return 0
+    with storage.open(image.name, 'rb') as source:
+        original = Image.open(source)
+        original.load()
+    if original.mode not in ('RGB', 'L'):
+        background = Image.new('RGB', original.size, 'white')
+        background.paste(original, mask=original.convert('RGBA').getchannel('A'))
+        original = background
+    for size, extension, name in missing:
+        resized = original.copy()
+        resized.thumbnail(sizes[size], Image.LANCZOS)
+        buffer = BytesIO()
+        resized.convert('RGB').save(buffer, **FORMATS[extension])
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(buffer.getvalue()))
+    return len(missing)
+
+
+def delete_derivatives(image, sizes):
+    """Удаляет производные, если оригинал больше никем не используется"""
+    if not image:
+        return
+    is_shared = getattr(image.storage, 'is_shared', None)
+    if is_shared is not None and is_shared(image.name):
+        return
+    for _, _, name in iter_derivative_names(image, sizes):
+        image.storage.delete(name)
+
+
+def delete_unused_image(storage, name, sizes):
+    """Удаляет изображение и его производные, если на изображение
+    больше не ссылается ни одна запись"""
+    is_used = getattr(storage, 'is_used', None)
+    if not name or is_used is not None and is_used(name):
+        return
+    for size in sizes:
+        for extension in FORMATS:
+            storage.delete(derivative_name(name, size, extension))
+    storage.delete(name)
+
+
+def derivative_url(image, size, extension, request=None):
+    url = image.storage.url(derivative_name(image.name, size, extension))
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def derivative_urls(image, sizes, request=None):
+    """URL производных изображений: {размер: {формат: url}}"""
+    if not image:
+        return None
+    return {
+        size: {
+            extension: derivative_url(image, size, extension, request)
+            for extension in FORMATS
+        }
+        for size in sizes
+    }
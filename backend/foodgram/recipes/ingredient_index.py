@@ -0,0 +1,105 @@
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import ProductComponent
+
+
+class IngredientIndex:
+    """Префиксный индекс продуктов в памяти процесса.
+
+    Хранит отсортированный массив ключей в нижнем регистре (casefold)
+    для каждого слова названия продукта. Индекс строится при первом
+    обращении, сбрасывается сигналами при изменении продуктов в этом
+    процессе и перестраивается не реже раза в ``max_age`` секунд, чтобы
+    подхватить изменения, сделанные другими процессами.
+    """
+
+    def __init__(self, max_age=None, limit=None):
+        self.max_age = max_age
+        self.limit = limit
+        self._lock = Lock()
+        self._state = None
+
+    def invalidate(self):
+        self._state = None
+
+    def all(self, snapshot=None):
+        return (snapshot or self._get_state())[2]
+
+    def modification_state(self, snapshot=None):
+        """Число продуктов в индексе и время последнего изменения"""
+        items, last_modified = (snapshot or self._get_state())[2:]
+        return {'count': len(items), 'components': last_modified}
+
+    def search(self, prefix, limit=None, snapshot=None):
+        """Продукты, название или слово названия которых начинается
+        с prefix: сначала совпадения с начала названия, затем более
+        короткие названия."""
+        prefix = prefix.strip().casefold()
+        if not prefix:
+            return []
+        keys, positions, items, _ = snapshot or self._get_state()
+        matches = {}
+        index = bisect_left(keys, prefix)
+        while index < len(keys) and keys[index].startswith(prefix):
+            item_index, word_start = positions[index]
+            rank = (word_start > 0, len(items[item_index]['title']), item_index)
+            if item_index not in matches or rank < matches[item_index]:
+                matches[item_index] = rank
+            index += 1
+        ranked = sorted(matches, key=matches.__getitem__)
+        return [items[item_index] for item_index in ranked[:limit or self.limit]]
+
+    async def aload(self):
+        """Снимок индекса для all, search и modification_state
+        (аргумент snapshot). Устаревший индекс строится в потоке,
+        не блокируя цикл событий; со снимком эти методы не обращаются
+        к БД, даже если сигнал сбросит индекс."""
+        state = self._state
+        if self._is_stale(state):
+            return await sync_to_async(self._get_state)()
+        return state[1:]
+
+    def _is_stale(self, state):
+        return state is None or monotonic() - state[0] > self.max_age
+
+    def _get_state(self):
+        state = self._state
+        if self._is_stale(state):
+            with self._lock:
+                state = self._state
+                if self._is_stale(state):
+                    state = self._state = (monotonic(), *self._build())
+        return state[1:]
+
+    def _build(self):
+        items = list(
+            ProductComponent.objects
+            .order_by('title')
+            .values('id', 'title', 'unit_type', 'updated_at')
+        )
+        last_modified = max(
+            (item.pop('updated_at') for item in items), default=None
+        )
+        entries = []
+        for item_index, item in enumerate(items):
+            title = item['title'].casefold()
+            word_start = 0
+            for word in title.split():
+                word_start = title.index(word, word_start)
+                entries.append((title[word_start:], item_index, word_start))
+                word_start += len(word)
+        entries.sort()
+        keys = [key for key, *_ in entries]
+        positions = [position for _, *position in entries]
+        return keys, positions, items, last_modified
+
+
+ingredient_index = IngredientIndex(
+    max_age=getattr(settings, 'INGREDIENT_INDEX_MAX_AGE', 300),
+    limit=getattr(settings, 'INGREDIENT_SEARCH_LIMIT', 50),
+)
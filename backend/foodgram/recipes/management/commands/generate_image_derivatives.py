@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy as _
+from recipes.images import AVATAR_SIZES, RECIPE_PICTURE_SIZES, generate_derivatives
+from recipes.models import CookingRecipe, User
+
+
+class Command(BaseCommand):
+    help = _('Создаёт уменьшенные копии картинок рецептов и аватаров')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help=_('Пересоздать уже существующие копии')
+        )
+
+    def handle(self, *args, **options):
+        force = options['force']
+        sources = (
+            (CookingRecipe.objects.exclude(picture=''), 'picture', RECIPE_PICTURE_SIZES),
+            (
+                User.objects.exclude(avatar='').exclude(avatar__isnull=True),
+                'avatar', AVATAR_SIZES
+            ),
+        )
+        created = 0
+        for queryset, field, sizes in sources:
+            for instance in queryset.only('pk', field).iterator():
+                image = getattr(instance, field)
+                try:
+                    created += generate_derivatives(image, sizes, force)
+                except (OSError, ValueError) as error:
+                    self.stdout.write(
+                        self.style.WARNING(_(f'Пропущено {image}: {error}'))
+                    )
+
+        self.stdout.write(
+            self.style.SUCCESS(_(f'Создано копий изображений: {created}'))
+        )
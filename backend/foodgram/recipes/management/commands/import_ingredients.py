@@ -1,43 +1,157 @@
+import os
+
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
 from django.utils.translation import gettext_lazy as _
+from recipes.bulk_load import copy_rows, iter_batches, iter_csv_rows, iter_json_array
+from recipes.ingredient_index import ingredient_index
 from recipes.models import ProductComponent
-import json
+
+TABLE = ProductComponent._meta.db_table
+TITLE_LENGTH = ProductComponent._meta.get_field('title').max_length
+UNIT_TYPE_LENGTH = ProductComponent._meta.get_field('unit_type').max_length
 
 
 class Command(BaseCommand):
+    help = _('Импортирует продукты из CSV или JSON, пропуская уже существующие')
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--path',
-            default='data/ingredients.json',
-            help=_('Путь к JSON файлу с продуктами (относительно корня проекта)') 
+            default='data/ingredients.csv',
+            help=_('Путь к CSV или JSON файлу с продуктами (относительно корня проекта)')
         )
-        
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'json'),
+            help=_('Формат файла, по умолчанию определяется по расширению')
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help=_('Количество строк, вставляемых одним запросом')
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help=_('Загрузить файл через COPY (только PostgreSQL)')
+        )
+
     def handle(self, *args, **options):
         file_path = options['path']
+        file_format = (
+            options['format']
+            or os.path.splitext(file_path)[1].lstrip('.').lower()
+        )
+        use_copy = options['copy']
+        if use_copy and connection.vendor != 'postgresql':
+            self.stdout.write(
+                self.style.WARNING(_('COPY доступен только в PostgreSQL, используется INSERT'))
+            )
+            use_copy = False
+        self.total = self.invalid = 0
 
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                ingredients = [
-                    ProductComponent(
-                        **{'title': item['name'], 'unit_type': item['measurement_unit']}
-                    )
-                    for item in json.load(file)
-                ]
-
-                existing_count = ProductComponent.objects.count()
-                
-                ProductComponent.objects.bulk_create(ingredients, ignore_conflicts=True)
-                
-                added_count = ProductComponent.objects.count() - existing_count
-
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        _(f'Успешно импортировано {added_count} из {len(ingredients)} ингредиентов')
+            with open(file_path, 'r', encoding='utf-8', newline='') as file:
+                rows = self.read_rows(file, file_format)
+                if use_copy:
+                    inserted = self.copy(rows, options['batch_size'])
+                else:
+                    inserted = sum(
+                        self.insert_batch(batch)
+                        for batch in iter_batches(rows, options['batch_size'])
                     )
-                )
-
-
         except Exception as e:
             self.stdout.write(
-            self.style.ERROR(_(f'Ошибка при обработке файла {file_path}: {e}'))
-            )
\ No newline at end of file
+                self.style.ERROR(_(f'Ошибка при обработке файла {file_path}: {e}'))
+            )
+            return
+        finally:
+            ingredient_index.invalidate()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                _(f'Импортировано {inserted} из {self.total} ингредиентов, '
+                  f'пропущено {self.total - inserted} существующих и повторов, '
+                  f'некорректных строк: {self.invalid}')
+            )
+        )
+
+    def read_rows(self, file, file_format):
+        """Поток пар (title, unit_type); некорректные строки считаются
+        и пропускаются"""
+        if file_format == 'json':
+            items = (
+                (item.get('name'), item.get('measurement_unit'))
+                if isinstance(item, dict) else (None, None)
+                for item in iter_json_array(file)
+            )
+        elif file_format == 'csv':
+            items = (
+                row[:2] if len(row) >= 2 else (None, None)
+                for row in iter_csv_rows(file)
+            )
+        else:
+            raise ValueError(_(f'Неизвестный формат файла: {file_format}'))
+        for title, unit_type in items:
+            if not isinstance(title, str) or not isinstance(unit_type, str):
+                self.invalid += 1
+                continue
+            title, unit_type = title.strip(), unit_type.strip()
+            if not (
+                0 < len(title) <= TITLE_LENGTH
+                and 0 < len(unit_type) <= UNIT_TYPE_LENGTH
+            ):
+                self.invalid += 1
+                continue
+            self.total += 1
+            yield title, unit_type
+
+    def insert_batch(self, rows):
+        """Вставляет отсутствующие продукты, возвращает число вставленных"""
+        rows = list(dict.fromkeys(rows))
+        if connection.vendor == 'postgresql':
+            titles, unit_types = zip(*rows)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {TABLE} (title, unit_type, recipes_count, updated_at) '
+                    'SELECT title, unit_type, 0, now() '
+                    'FROM unnest(%s::text[], %s::text[]) AS imported (title, unit_type) '
+                    'ON CONFLICT (title, unit_type) DO NOTHING',
+                    [list(titles), list(unit_types)]
+                )
+                return cursor.rowcount
+        with transaction.atomic():
+            existing = set(
+                ProductComponent.objects
+                .filter(title__in={title for title, _ in rows})
+                .values_list('title', 'unit_type')
+            )
+            missing = [row for row in rows if row not in existing]
+            ProductComponent.objects.bulk_create(
+                (
+                    ProductComponent(title=title, unit_type=unit_type)
+                    for title, unit_type in missing
+                ),
+                ignore_conflicts=True
+            )
+        return len(missing)
+
+    def copy(self, rows, batch_size):
+        """Загружает файл во временную таблицу через COPY и переносит
+        новые продукты одним INSERT ... SELECT"""
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE import_products '
+                '(title text, unit_type text) ON COMMIT DROP'
+            )
+            for batch in iter_batches(rows, batch_size):
+                copy_rows(cursor, 'import_products', ('title', 'unit_type'), batch)
+            cursor.execute(
+                f'INSERT INTO {TABLE} (title, unit_type, recipes_count, updated_at) '
+                'SELECT title, unit_type, 0, now() FROM import_products '
+                'GROUP BY title, unit_type '
+                'ON CONFLICT (title, unit_type) DO NOTHING'
+            )
+            return cursor.rowcount
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy as _
+from recipes.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = _('Пересчитывает денормализованные счётчики и исправляет расхождения')
+
+    def handle(self, *args, **options):
+        for counter, fixed in reconcile_counters().items():
+            self.stdout.write(_(f'{counter}: исправлено {fixed}'))
+        self.stdout.write(self.style.SUCCESS(_('Счётчики пересчитаны')))
@@ -0,0 +1,261 @@
+import random
+import re
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models.fields.files import FieldFile
+from django.db.models.functions import Length
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from PIL import Image
+from api.cache import bump_generation
+from recipes.bulk_load import copy_rows, iter_batches
+from recipes.component_index import component_index
+from recipes.counters import reconcile_counters
+from recipes.feed import rebuild_feeds
+from recipes.images import AVATAR_SIZES, RECIPE_PICTURE_SIZES, generate_derivatives
+from recipes.models import (
+    CookingRecipe, FavoriteRecipe, ProductComponent, RecipeComponent,
+    ShoppingCart, User, UserSubscription
+)
+
+PLACEHOLDER_COLORS = (
+    '#e07a5f', '#3d405b', '#81b29a', '#f2cc8f',
+    '#9c6644', '#bc4749', '#6a994e', '#457b9d',
+)
+RECIPE_WORDS = (
+    'Суп', 'Салат', 'Пирог', 'Каша', 'Рагу', 'Запеканка', 'Омлет',
+    'Плов', 'Паста', 'Котлеты', 'Блины', 'Сырники',
+)
+FIRST_NAMES = ('Иван', 'Мария', 'Алексей', 'Ольга', 'Дмитрий', 'Анна', 'Сергей', 'Елена')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов')
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Позволяет задать значения полей auto_now/auto_now_add при bulk_create"""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def zipf_weights(size, alpha):
+    """Накопленные веса степенного распределения для rng.choices"""
+    return list(accumulate(1 / rank ** alpha for rank in range(1, size + 1)))
+
+
+class Command(BaseCommand):
+    help = _(
+        'Заполняет базу синтетическими пользователями, рецептами, '
+        'подписками, избранным и корзинами для нагрузочного тестирования'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help=_('Количество пользователей'))
+        parser.add_argument('--recipes', type=int, default=10000,
+                            help=_('Количество рецептов'))
+        parser.add_argument('--subscriptions', type=int, default=20,
+                            help=_('Среднее число подписок пользователя'))
+        parser.add_argument('--favorites', type=int, default=30,
+                            help=_('Среднее число избранных рецептов пользователя'))
+        parser.add_argument('--cart', type=int, default=5,
+                            help=_('Среднее число рецептов в корзине пользователя'))
+        parser.add_argument('--components', type=int, nargs=2, default=(3, 10),
+                            metavar=('MIN', 'MAX'),
+                            help=_('Диапазон числа продуктов в рецепте'))
+        parser.add_argument('--alpha', type=float, default=1.1,
+                            help=_('Показатель степенного распределения популярности'))
+        parser.add_argument('--seed', type=int, default=0,
+                            help=_('Начальное значение генератора случайных чисел'))
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help=_('Количество строк, вставляемых одним запросом'))
+        parser.add_argument('--copy', action='store_true',
+                            help=_('Загружать связи через COPY (только PostgreSQL)'))
+        parser.add_argument('--skip-feeds', action='store_true',
+                            help=_('Не заполнять ленты созданных пользователей'))
+        parser.add_argument('--password', default='foodgram-seed',
+                            help=_('Пароль всех созданных пользователей'))
+        parser.add_argument('--prefix', default='seed',
+                            help=_('Префикс имён создаваемых пользователей'))
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.use_copy = options['copy']
+        if self.use_copy and connection.vendor != 'postgresql':
+            self.stdout.write(
+                self.style.WARNING(_('COPY доступен только в PostgreSQL, используется INSERT'))
+            )
+            self.use_copy = False
+        products = list(ProductComponent.objects.values_list('pk', flat=True))
+        if not products:
+            raise CommandError(_('Справочник продуктов пуст, сначала выполните import_ingredients'))
+        minimum, maximum = options['components']
+        if not 1 <= minimum <= maximum <= len(products):
+            raise CommandError(_(f'Число продуктов в рецепте должно быть от 1 до {len(products)}'))
+
+        pictures, avatars = self.create_placeholders()
+        users = self.create_users(options['users'], options['prefix'], options['password'], avatars)
+        self.report(_(f'Пользователей: {len(users)}'))
+
+        # Популярность авторов и рецептов задаётся случайным порядком
+        # и степенными весами: немногие получают большую часть связей.
+        self.rng.shuffle(users)
+        user_weights = zipf_weights(len(users), options['alpha'])
+        recipes = self.create_recipes(
+            options['recipes'], users, user_weights, products, (minimum, maximum), pictures
+        )
+        self.report(_(f'Рецептов: {len(recipes)}'))
+        self.rng.shuffle(recipes)
+        recipe_weights = zipf_weights(len(recipes), options['alpha'])
+
+        for model, field, targets, weights, mean in (
+            (UserSubscription, ('subscriber_id', 'target_user_id'), users, user_weights,
+             options['subscriptions']),
+            (FavoriteRecipe, ('user_id', 'recipe_id'), recipes, recipe_weights, options['favorites']),
+            (ShoppingCart, ('user_id', 'recipe_id'), recipes, recipe_weights, options['cart']),
+        ):
+            count = self.insert(model, field, self.relation_rows(users, targets, weights, mean))
+            self.report(_(f'{model._meta.verbose_name_plural}: {count}'))
+
+        reconcile_counters()
+        call_command('update_search_vectors', batch_size=self.batch_size, stdout=self.stdout)
+        if not options['skip_feeds']:
+            # Ленты остальных пользователей сигналы уже поддерживают.
+            self.report(_(f'Записей лент: {rebuild_feeds(users)}'))
+        # Строки вставлены в обход сигналов: кэш ответов API и индексы
+        # продуктов рецептов во всех процессах устарели.
+        bump_generation()
+        component_index.reset()
+        self.stdout.write(self.style.SUCCESS(_('База заполнена синтетическими данными')))
+
+    def report(self, message):
+        self.stdout.write(str(message))
+
+    def create_placeholders(self):
+        """Несколько однотонных картинок с копиями всех размеров:
+        хранилище по хешу содержимого сохраняет каждую один раз"""
+        names = {}
+        for kind, field, size, sizes in (
+            ('pictures', CookingRecipe._meta.get_field('picture'), (1200, 800), RECIPE_PICTURE_SIZES),
+            ('avatars', User._meta.get_field('avatar'), (320, 320), AVATAR_SIZES),
+        ):
+            names[kind] = []
+            for color in PLACEHOLDER_COLORS:
+                buffer = BytesIO()
+                Image.new('RGB', size, color).save(buffer, format='JPEG', quality=80)
+                name = default_storage.save(
+                    f'{field.upload_to}/placeholder.jpg', ContentFile(buffer.getvalue())
+                )
+                generate_derivatives(FieldFile(None, field, name), sizes)
+                names[kind].append(name)
+        return names['pictures'], names['avatars']
+
+    def create_users(self, count, prefix, password, avatars):
+        password = make_password(password)
+        start = self.next_user_number(prefix)
+        now = timezone.now()
+        users = []
+        for batch in iter_batches(range(start, start + count), self.batch_size):
+            users += User.objects.bulk_create(
+                User(
+                    email=f'{prefix}{index}@foodgram.ru',
+                    username=f'{prefix}{index}',
+                    first_name=self.rng.choice(FIRST_NAMES),
+                    last_name=self.rng.choice(LAST_NAMES),
+                    password=password,
+                    date_joined=now,
+                    avatar=self.rng.choice(avatars) if self.rng.random() < 0.3 else None,
+                )
+                for index in batch
+            )
+        return [user.pk for user in users]
+
+    def next_user_number(self, prefix):
+        """Номер после наибольшего числового суффикса имён с префиксом:
+        число таких имён не годится, если часть из них удалена или
+        не сгенерирована"""
+        last = (
+            User.objects
+            .filter(username__regex=rf'^{re.escape(prefix)}(0|[1-9][0-9]*)$')
+            .annotate(length=Length('username'))
+            .order_by('-length', '-username')
+            .values_list('username', flat=True)
+            .first()
+        )
+        return int(last[len(prefix):]) + 1 if last else 0
+
+    def create_recipes(self, count, users, user_weights, products, component_range, pictures):
+        """Рецепты с датами за последний год и продуктами из справочника"""
+        now = timezone.now()
+        recipe_ids = []
+        date_created = CookingRecipe._meta.get_field('date_created')
+        updated_at = CookingRecipe._meta.get_field('updated_at')
+        for batch in iter_batches(range(count), self.batch_size):
+            creators = self.rng.choices(users, cum_weights=user_weights, k=len(batch))
+            recipes = []
+            for index, creator in zip(batch, creators):
+                created = now - timedelta(seconds=self.rng.randint(0, 365 * 24 * 3600))
+                recipes.append(CookingRecipe(
+                    creator_id=creator,
+                    title=f'{self.rng.choice(RECIPE_WORDS)} №{index + 1}',
+                    description='Подготовить продукты, смешать и довести до готовности.',
+                    cook_duration=self.rng.randint(5, 180),
+                    picture=self.rng.choice(pictures),
+                    date_created=created,
+                    updated_at=created,
+                ))
+            with explicit_timestamps(date_created, updated_at):
+                recipes = CookingRecipe.objects.bulk_create(recipes)
+            batch_ids = [recipe.pk for recipe in recipes]
+            self.insert(
+                RecipeComponent, ('recipe_id', 'component_id', 'quantity'),
+                (
+                    (recipe_id, component_id, self.rng.randint(1, 500))
+                    for recipe_id in batch_ids
+                    for component_id in self.rng.sample(
+                        products, self.rng.randint(*component_range)
+                    )
+                )
+            )
+            recipe_ids += batch_ids
+        return recipe_ids
+
+    def relation_rows(self, users, targets, weights, mean):
+        """Пары (пользователь, цель) без повторов: число связей
+        пользователя и выбор целей распределены по степенному закону"""
+        for user in users:
+            count = min(len(targets), int(self.rng.paretovariate(2) * mean / 2))
+            chosen = set(self.rng.choices(targets, cum_weights=weights, k=count))
+            chosen.discard(user if targets is users else None)
+            for target in chosen:
+                yield user, target
+
+    def insert(self, model, fields, rows):
+        """Вставляет строки пачками через COPY или bulk_create"""
+        inserted = 0
+        columns = [model._meta.get_field(field).column for field in fields]
+        for batch in iter_batches(rows, self.batch_size):
+            if self.use_copy:
+                with connection.cursor() as cursor:
+                    copy_rows(cursor, model._meta.db_table, columns, batch)
+            else:
+                model.objects.bulk_create(
+                    model(**dict(zip(fields, row))) for row in batch
+                )
+            inserted += len(batch)
+        return inserted
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils.translation import gettext_lazy as _
+from recipes.models import CookingRecipe
+
+
+class Command(BaseCommand):
+    help = _('Пересчитывает поисковые векторы рецептов')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help=_('Количество рецептов, обновляемых одним запросом')
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(
+                self.style.WARNING(_('Полнотекстовый поиск доступен только в PostgreSQL'))
+            )
+            return
+
+        batch_size = options['batch_size']
+        ids = CookingRecipe.objects.order_by('pk').values_list('pk', flat=True)
+        last_pk = 0
+        updated = 0
+        while True:
+            batch = list(ids.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            updated += CookingRecipe.objects.filter(
+                pk__gte=batch[0], pk__lte=last_pk
+            ).update_search_vector()
+
+        self.stdout.write(
+            self.style.SUCCESS(_(f'Обновлено поисковых векторов: {updated}'))
+        )
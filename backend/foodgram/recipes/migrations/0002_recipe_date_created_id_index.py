@@ -0,0 +1,21 @@
+# Generated by Django 5.2.3 on 2026-10-18 01:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cookingrecipe',
+            options={'ordering': ('-date_created', '-id'), 'verbose_name': 'Рецепт', 'verbose_name_plural': 'Рецепты'},
+        ),
+        migrations.AddIndex(
+            model_name='cookingrecipe',
+            index=models.Index(fields=['-date_created', '-id'], name='recipe_date_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.3 on 2026-10-18 01:55
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('CookingRecipe', 'favorites_count', 'FavoriteRecipe', 'recipe'),
+    ('CookingRecipe', 'shopping_cart_count', 'ShoppingCart', 'recipe'),
+    ('User', 'recipes_count', 'CookingRecipe', 'creator'),
+    ('User', 'subscribers_count', 'UserSubscription', 'target_user'),
+    ('User', 'subscriptions_count', 'UserSubscription', 'subscriber'),
+    ('ProductComponent', 'recipes_count', 'RecipeComponent', 'component'),
+)
+
+
+def populate_counters(apps, schema_editor):
+    for model_name, field, related_model_name, related_field in COUNTERS:
+        related_model = apps.get_model('recipes', related_model_name)
+        apps.get_model('recipes', model_name).objects.update(**{
+            field: Coalesce(
+                Subquery(
+                    related_model.objects
+                    .filter(**{related_field: OuterRef('pk')})
+                    .order_by()
+                    .values(related_field)
+                    .annotate(total=Count('pk'))
+                    .values('total')
+                ),
+                Value(0)
+            )
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cookingrecipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='cookingrecipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.AddField(
+            model_name='productcomponent',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='subscriptions_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписок'),
+        ),
+        migrations.AddIndex(
+            model_name='cookingrecipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
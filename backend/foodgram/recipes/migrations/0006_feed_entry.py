@@ -0,0 +1,59 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_feeds(apps, schema_editor):
+    FeedEntry = apps.get_model('recipes', 'FeedEntry')
+    CookingRecipe = apps.get_model('recipes', 'CookingRecipe')
+    UserSubscription = apps.get_model('recipes', 'UserSubscription')
+    subscriptions = UserSubscription.objects.filter(
+        target_user__subscribers_count__lt=settings.FEED_FANOUT_LIMIT
+    ).order_by('target_user').values_list('target_user', 'subscriber')
+    author_id, recipes = None, []
+    for target_user_id, subscriber_id in subscriptions.iterator(chunk_size=1000):
+        if target_user_id != author_id:
+            author_id = target_user_id
+            recipes = list(
+                CookingRecipe.objects
+                .filter(creator_id=author_id)
+                .order_by('-date_created', '-id')
+                .values_list('pk', 'date_created')[:settings.FEED_BACKFILL_LIMIT]
+            )
+        FeedEntry.objects.bulk_create(
+            [
+                FeedEntry(user_id=subscriber_id, recipe_id=pk, date_created=date_created)
+                for pk, date_created in recipes
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_created', models.DateTimeField(verbose_name='Дата создания рецепта')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.cookingrecipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Ленты подписок',
+                'abstract': False,
+                'default_related_name': 'feed_entries',
+                'indexes': [models.Index(fields=['user', '-date_created', '-recipe'], name='feed_user_date_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'recipe'), name='feedentry_unique_user_recipe')],
+            },
+        ),
+        migrations.RunPython(populate_feeds, migrations.RunPython.noop),
+    ]
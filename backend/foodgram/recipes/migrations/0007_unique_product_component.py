@@ -0,0 +1,56 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:09
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def merge_duplicate_products(apps, schema_editor):
+    """Оставляет по одному продукту на пару (title, unit_type),
+    переносит на него строки рецептов дубликатов. Если в рецепте есть
+    и оставленный продукт, и дубликат, количество дубликата
+    прибавляется к строке оставленного."""
+    ProductComponent = apps.get_model('recipes', 'ProductComponent')
+    RecipeComponent = apps.get_model('recipes', 'RecipeComponent')
+    duplicates = (
+        ProductComponent.objects
+        .values('title', 'unit_type')
+        .annotate(keep=Min('pk'), total=Count('pk'))
+        .filter(total__gt=1)
+    )
+    for duplicate in list(duplicates):
+        keep = duplicate['keep']
+        others = ProductComponent.objects.filter(
+            title=duplicate['title'], unit_type=duplicate['unit_type']
+        ).exclude(pk=keep)
+        for other in others.values_list('pk', flat=True):
+            rows = RecipeComponent.objects.filter(component_id=other)
+            conflicts = rows.filter(
+                recipe__in=RecipeComponent.objects
+                .filter(component_id=keep)
+                .values('recipe')
+            )
+            for recipe_id, quantity in conflicts.values_list('recipe', 'quantity'):
+                RecipeComponent.objects.filter(
+                    recipe_id=recipe_id, component_id=keep
+                ).update(quantity=F('quantity') + quantity)
+            conflicts.delete()
+            rows.update(component_id=keep)
+        others.delete()
+        ProductComponent.objects.filter(pk=keep).update(
+            recipes_count=RecipeComponent.objects.filter(component_id=keep).count()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_feed_entry'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_products, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productcomponent',
+            constraint=models.UniqueConstraint(fields=('title', 'unit_type'), name='unique_product_component'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations, models
+
+import recipes.models
+
+BATCH_SIZE = 1000
+
+
+def populate_short_codes(apps, schema_editor):
+    CookingRecipe = apps.get_model('recipes', 'CookingRecipe')
+    batch = []
+    for recipe in CookingRecipe.objects.only('pk').iterator(chunk_size=BATCH_SIZE):
+        recipe.short_code = recipes.models.generate_short_code()
+        batch.append(recipe)
+        if len(batch) == BATCH_SIZE:
+            CookingRecipe.objects.bulk_update(batch, ['short_code'])
+            batch = []
+    CookingRecipe.objects.bulk_update(batch, ['short_code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_unique_product_component'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cookingrecipe',
+            name='short_code',
+            field=models.CharField(
+                editable=False, max_length=8, null=True,
+                verbose_name='Код короткой ссылки'
+            ),
+        ),
+        migrations.AddField(
+            model_name='cookingrecipe',
+            name='short_link_hits',
+            field=models.PositiveIntegerField(
+                default=0, editable=False,
+                verbose_name='Переходов по короткой ссылке'
+            ),
+        ),
+        migrations.RunPython(populate_short_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cookingrecipe',
+            name='short_code',
+            field=models.CharField(
+                default=recipes.models.generate_short_code, editable=False,
+                max_length=8, unique=True, verbose_name='Код короткой ссылки'
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-18 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('recipes', '0008_short_code'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cookingrecipe',
+            index=models.Index(fields=['picture'], name='recipe_picture_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['avatar'], name='user_avatar_idx'),
+        ),
+    ]
@@ -1,8 +1,27 @@
+import secrets
+from string import ascii_letters, digits
+
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import connection, models
+from django.db.models import Count, Exists, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
 
+SHORT_CODE_ALPHABET = digits + ascii_letters
+SHORT_CODE_LENGTH = 8
+
+
+def generate_short_code():
+    """Случайный код base62 короткой ссылки: 62⁸ вариантов делают
+    совпадения практически невозможными, а id рецептов не раскрываются"""
+    return ''.join(
+        secrets.choice(SHORT_CODE_ALPHABET) for _ in range(SHORT_CODE_LENGTH)
+    )
+
 
 class User(AbstractUser):
     
@@ -25,6 +44,16 @@ class User(AbstractUser):
         null=True,
         blank=True
     )
+    recipes_count = models.PositiveIntegerField(
+        _('Количество рецептов'), default=0, editable=False
+    )
+    subscribers_count = models.PositiveIntegerField(
+        _('Количество подписчиков'), default=0, editable=False
+    )
+    subscriptions_count = models.PositiveIntegerField(
+        _('Количество подписок'), default=0, editable=False
+    )
+    updated_at = models.DateTimeField(_('Дата изменения'), auto_now=True)
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -33,6 +62,10 @@ class User(AbstractUser):
         ordering = ('username',)
         verbose_name = _('Пользователь')
         verbose_name_plural = _('Пользователи')
+        indexes = [
+            # Поиск ссылок на файл перед его удалением.
+            models.Index(fields=['avatar'], name='user_avatar_idx'),
+        ]
 
 
 class UserSubscription(models.Model):
@@ -68,16 +101,94 @@ class ProductComponent(models.Model):
     
     title = models.CharField(_('Наименование'), max_length=128)
     unit_type = models.CharField(_('Единица измерения'), max_length=64)
+    recipes_count = models.PositiveIntegerField(
+        _('Количество рецептов'), default=0, editable=False
+    )
+    updated_at = models.DateTimeField(_('Дата изменения'), auto_now=True)
 
     class Meta:
         ordering = ('title',)
         verbose_name = _('Продукт')
         verbose_name_plural = _('Продукты')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['title', 'unit_type'],
+                name='unique_product_component'
+            )
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.unit_type})"
 
 
+SEARCH_CONFIG = 'russian'
+
+
+class CookingRecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        """Аннотирует рецепты флагами is_favorited, is_in_shopping_cart
+        и подпиской пользователя на автора рецепта"""
+        if not user or not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                creator_is_subscribed=Value(False)
+            )
+        return self.annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            creator_is_subscribed=Exists(UserSubscription.objects.filter(
+                subscriber=user, target_user=OuterRef('creator')
+            ))
+        )
+
+    MODIFICATION_STATE = {
+        'count': Count('pk', distinct=True),
+        'recipes': Max('updated_at'),
+        'creators': Max('creator__updated_at'),
+        'components': Max('recipe_components__component__updated_at'),
+    }
+
+    def modification_state(self):
+        """Число рецептов и время последнего изменения их самих,
+        их авторов и продуктов. Агрегат идёт по соединению таблиц,
+        поэтому подходит для одного рецепта, а не для списка."""
+        return self.order_by().aggregate(**self.MODIFICATION_STATE)
+
+    async def amodification_state(self):
+        return await self.order_by().aaggregate(**self.MODIFICATION_STATE)
+
+    def update_search_vector(self):
+        """Пересчитывает поисковый вектор: название, описание
+        и названия продуктов с весами A, B и C"""
+        if connection.vendor != 'postgresql':
+            return 0
+        component_titles = (
+            RecipeComponent.objects
+            .filter(recipe=OuterRef('pk'))
+            .order_by()
+            .values('recipe')
+            .annotate(titles=StringAgg('component__title', ' '))
+            .values('titles')
+        )
+        return self.update(search_vector=(
+            SearchVector('title', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+            + SearchVector(
+                Coalesce(
+                    Subquery(component_titles), Value(''),
+                    output_field=models.TextField()
+                ),
+                weight='C', config=SEARCH_CONFIG
+            )
+        ))
+
+
 class CookingRecipe(models.Model):
     
     title = models.CharField(_('Название рецепта'), max_length=256)
@@ -103,11 +214,40 @@ class CookingRecipe(models.Model):
         through_fields=('recipe', 'component')
     )
     date_created = models.DateTimeField(_('Дата создания'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('Дата изменения'), auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    favorites_count = models.PositiveIntegerField(
+        _('В избранном'), default=0, editable=False
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        _('В корзинах'), default=0, editable=False
+    )
+    short_code = models.CharField(
+        _('Код короткой ссылки'), max_length=SHORT_CODE_LENGTH, unique=True,
+        default=generate_short_code, editable=False
+    )
+    short_link_hits = models.PositiveIntegerField(
+        _('Переходов по короткой ссылке'), default=0, editable=False
+    )
+
+    objects = CookingRecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ('-date_created',)
+        ordering = ('-date_created', '-id')
         verbose_name = _('Рецепт')
         verbose_name_plural = _('Рецепты')
+        indexes = [
+            models.Index(
+                fields=['-date_created', '-id'],
+                name='recipe_date_created_id_idx'
+            ),
+            GinIndex(fields=['search_vector'], name='recipe_search_vector_idx'),
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_favorites_count_idx'
+            ),
+            models.Index(fields=['picture'], name='recipe_picture_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -188,3 +328,20 @@ class FavoriteRecipe(BaseUserRecipeRelation):
         verbose_name = _('Избранный рецепт')
         verbose_name_plural = _('Избранные рецепты')
         default_related_name = 'favorite_recipes'
+
+
+class FeedEntry(BaseUserRecipeRelation):
+    """Рецепт в ленте подписчика, записывается при публикации"""
+
+    date_created = models.DateTimeField(_('Дата создания рецепта'))
+
+    class Meta(BaseUserRecipeRelation.Meta):
+        verbose_name = _('Запись ленты')
+        verbose_name_plural = _('Ленты подписок')
+        default_related_name = 'feed_entries'
+        indexes = [
+            models.Index(
+                fields=['user', '-date_created', '-recipe'],
+                name='feed_user_date_created_idx'
+            ),
+        ]
@@ -0,0 +1,208 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from math import ceil, log
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.db.models import Case, F, Value, When
+
+from .models import CookingRecipe
+
+
+class BloomFilter:
+    """Фильтр Блума: множество без ложноотрицательных ответов,
+    ложноположительные — с долей около error_rate при заполнении
+    до capacity"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * log(2)))
+        self.bits = bytearray(ceil(self.size / 8))
+        self.count = 0
+
+    def _positions(self, key):
+        digest = blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & 1 << (position & 7)
+            for position in self._positions(key)
+        )
+
+
+class ShortLinkIndex:
+    """Коды коротких ссылок в памяти процесса: фильтр Блума всех кодов
+    и LRU-кэш код → id рецепта.
+
+    Код из кэша разрешается без обращения к БД, код не из фильтра
+    отклоняется тоже без него. Сигналы добавляют созданные в этом
+    процессе рецепты и удаляют из кэша удалённые. Рецепты других
+    процессов и bulk_create подхватываются дозагрузкой по id, не чаще
+    раза в ``refresh_interval`` секунд, фильтр перестраивается целиком
+    раз в ``max_age`` секунд. Удалённый в другом процессе рецепт может
+    оставаться в кэше до перестройки.
+    """
+
+    def __init__(self, max_age=None, cache_size=None, refresh_interval=None):
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self.refresh_interval = refresh_interval
+        self._lock = Lock()
+        self._cache = OrderedDict()
+        self._bloom = None
+        self._built_at = self._refreshed_at = 0
+        self._last_id = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._bloom = None
+
+    def cached(self, code):
+        """id рецепта из кэша или None, без обращения к БД"""
+        with self._lock:
+            recipe_id = self._cache.get(code)
+            if recipe_id is not None:
+                self._cache.move_to_end(code)
+            return recipe_id
+
+    def resolve(self, code):
+        """id рецепта по коду или None"""
+        recipe_id = self.cached(code)
+        if recipe_id is not None:
+            return recipe_id
+        bloom = self._ensure_built()
+        if code not in bloom:
+            bloom = self._refresh()
+            if bloom is None or code not in bloom:
+                return None
+        recipe_id = (
+            CookingRecipe.objects.filter(short_code=code)
+            .values_list('pk', flat=True).first()
+        )
+        if recipe_id is not None:
+            self._remember(code, recipe_id)
+        return recipe_id
+
+    def add(self, code, recipe_id):
+        with self._lock:
+            if self._bloom is None:
+                return
+            self._bloom.add(code)
+            if self._bloom.count > self._bloom.capacity:
+                # Переполненный фильтр даёт больше ложных срабатываний.
+                self._built_at = 0
+        self._remember(code, recipe_id)
+
+    def discard(self, code):
+        with self._lock:
+            self._cache.pop(code, None)
+
+    def _remember(self, code, recipe_id):
+        with self._lock:
+            self._cache[code] = recipe_id
+            self._cache.move_to_end(code)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _is_stale(self):
+        return self._bloom is None or monotonic() - self._built_at > self.max_age
+
+    def _ensure_built(self):
+        if not self._is_stale():
+            return self._bloom
+        with self._lock:
+            if not self._is_stale():
+                return self._bloom
+            rows = CookingRecipe.objects.order_by().values_list('pk', 'short_code')
+            codes = {}
+            for recipe_id, code in rows.iterator(chunk_size=10000):
+                codes[code] = recipe_id
+            bloom = BloomFilter(max(len(codes) * 2, 1024))
+            for code in codes:
+                bloom.add(code)
+            self._last_id = max(codes.values(), default=0)
+            self._cache.clear()
+            self._bloom = bloom
+            self._built_at = self._refreshed_at = monotonic()
+            return bloom
+
+    def _refresh(self):
+        """Добавляет в фильтр рецепты с id больше загруженных;
+        фильтр или None, если дозагрузка не выполнялась"""
+        with self._lock:
+            bloom = self._bloom
+            # Фильтр мог быть сброшен после _ensure_built.
+            if bloom is None or monotonic() - self._refreshed_at < self.refresh_interval:
+                return None
+            self._refreshed_at = monotonic()
+            rows = list(
+                CookingRecipe.objects.filter(pk__gt=self._last_id)
+                .order_by('pk').values_list('pk', 'short_code')
+            )
+            for recipe_id, code in rows:
+                bloom.add(code)
+                self._last_id = recipe_id
+            if bloom.count > bloom.capacity:
+                self._built_at = 0
+            return bloom
+
+
+class HitCounter:
+    """Переходы по коротким ссылкам, накапливаемые в памяти процесса
+    и записываемые одним UPDATE на ``batch_size`` переходов или раз
+    в ``flush_interval`` секунд. Незаписанные переходы теряются при
+    остановке процесса."""
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = Lock()
+        self._pending = {}
+        self._count = 0
+        self._flushed_at = monotonic()
+
+    def hit(self, recipe_id):
+        """Учитывает переход; True, если пора вызвать flush"""
+        with self._lock:
+            self._pending[recipe_id] = self._pending.get(recipe_id, 0) + 1
+            self._count += 1
+            return (
+                self._count >= self.batch_size
+                or monotonic() - self._flushed_at >= self.flush_interval
+            )
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._count = 0
+            self._flushed_at = monotonic()
+        if not pending:
+            return 0
+        return CookingRecipe.objects.filter(pk__in=pending).update(
+            short_link_hits=F('short_link_hits') + Case(
+                *(When(pk=recipe_id, then=Value(hits))
+                  for recipe_id, hits in pending.items()),
+                default=Value(0),
+            )
+        )
+
+
+short_link_index = ShortLinkIndex(
+    max_age=getattr(settings, 'SHORT_LINK_INDEX_MAX_AGE', 600),
+    cache_size=getattr(settings, 'SHORT_LINK_CACHE_SIZE', 10000),
+    refresh_interval=getattr(settings, 'SHORT_LINK_REFRESH_INTERVAL', 1),
+)
+short_link_hits = HitCounter(
+    batch_size=getattr(settings, 'SHORT_LINK_HITS_BATCH', 100),
+    flush_interval=getattr(settings, 'SHORT_LINK_HITS_FLUSH_INTERVAL', 10),
+)
@@ -0,0 +1,156 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .component_index import component_index
+from .counters import COUNTERS, shift_counter
+from .feed import fan_out_recipe, subscribe_feed, unsubscribe_feed
+from .images import (
+    AVATAR_SIZES, RECIPE_PICTURE_SIZES, delete_unused_image, generate_derivatives
+)
+from .ingredient_index import ingredient_index
+from .models import (
+    CookingRecipe, ProductComponent, RecipeComponent, User, UserSubscription
+)
+from .short_links import short_link_index
+
+logger = logging.getLogger(__name__)
+
+
+@receiver((post_save, post_delete), sender=ProductComponent)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=CookingRecipe)
+def add_short_link(sender, instance, created, **kwargs):
+    if created:
+        short_link_index.add(instance.short_code, instance.pk)
+
+
+@receiver(post_delete, sender=CookingRecipe)
+def discard_short_link(sender, instance, **kwargs):
+    short_link_index.discard(instance.short_code)
+
+
+@receiver(post_save, sender=CookingRecipe)
+def update_recipe_search_vector(sender, instance, **kwargs):
+    CookingRecipe.objects.filter(pk=instance.pk).update_search_vector()
+
+
+def safe_generate_derivatives(image, sizes):
+    try:
+        generate_derivatives(image, sizes)
+    except OSError as error:
+        logger.warning('Не удалось создать копии изображения %s: %s', image.name, error)
+
+
+@receiver(post_save, sender=CookingRecipe)
+def generate_recipe_picture_derivatives(sender, instance, **kwargs):
+    safe_generate_derivatives(instance.picture, RECIPE_PICTURE_SIZES)
+
+
+@receiver(pre_save, sender=CookingRecipe)
+def remember_previous_picture(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._previous_picture = None
+    if instance._state.adding or raw or update_fields and 'picture' not in update_fields:
+        return
+    instance._previous_picture = (
+        sender.objects.filter(pk=instance.pk).values_list('picture', flat=True).first()
+    )
+
+
+def delete_picture_on_commit(storage, name):
+    # Файл удаляется после фиксации: при откате запись снова на него сошлётся.
+    transaction.on_commit(
+        lambda: delete_unused_image(storage, name, RECIPE_PICTURE_SIZES)
+    )
+
+
+@receiver(post_save, sender=CookingRecipe)
+def delete_replaced_picture(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_picture', None)
+    if previous and previous != instance.picture.name:
+        delete_picture_on_commit(instance.picture.storage, previous)
+
+
+@receiver(post_delete, sender=CookingRecipe)
+def delete_recipe_picture(sender, instance, **kwargs):
+    if instance.picture:
+        delete_picture_on_commit(instance.picture.storage, instance.picture.name)
+
+
+@receiver(post_save, sender=User)
+def generate_avatar_derivatives(sender, instance, update_fields=None, **kwargs):
+    if update_fields and 'avatar' not in update_fields:
+        return
+    safe_generate_derivatives(instance.avatar, AVATAR_SIZES)
+
+
+@receiver(post_save, sender=RecipeComponent)
+def index_recipe_component(sender, instance, created, **kwargs):
+    if created:
+        component_index.add(instance.recipe_id, [instance.component_id])
+    else:
+        component_index.reload(instance.recipe_id)
+
+
+@receiver(post_delete, sender=RecipeComponent)
+def unindex_recipe_component(sender, instance, **kwargs):
+    component_index.remove(instance.recipe_id, [instance.component_id])
+
+
+@receiver(post_save, sender=RecipeComponent)
+def update_component_recipe_search_vector(sender, instance, **kwargs):
+    CookingRecipe.objects.filter(pk=instance.recipe_id).update_search_vector()
+
+
+@receiver(post_save, sender=ProductComponent)
+def update_product_recipes_search_vector(sender, instance, created, **kwargs):
+    if not created:
+        CookingRecipe.objects.filter(
+            recipe_components__component=instance
+        ).update_search_vector()
+
+
+def shift_related_counters(instance, delta):
+    for model, field, related_model, related_field in COUNTERS:
+        if isinstance(instance, related_model):
+            shift_counter(
+                model, [getattr(instance, f'{related_field}_id')], field, delta
+            )
+
+
+def increment_counters(sender, instance, created, **kwargs):
+    if created:
+        shift_related_counters(instance, 1)
+
+
+def decrement_counters(sender, instance, **kwargs):
+    shift_related_counters(instance, -1)
+
+
+for counted_model in {counter[2] for counter in COUNTERS}:
+    post_save.connect(increment_counters, sender=counted_model)
+    post_delete.connect(decrement_counters, sender=counted_model)
+
+
+# Ленты подключаются после счётчиков: им нужно уже обновлённое
+# число подписчиков автора.
+@receiver(post_save, sender=CookingRecipe)
+def fan_out_new_recipe(sender, instance, created, **kwargs):
+    if created:
+        fan_out_recipe(instance)
+
+
+@receiver(post_save, sender=UserSubscription)
+def backfill_subscriber_feed(sender, instance, created, **kwargs):
+    if created:
+        subscribe_feed(instance.subscriber_id, instance.target_user_id)
+
+
+@receiver(post_delete, sender=UserSubscription)
+def clean_subscriber_feed(sender, instance, **kwargs):
+    unsubscribe_feed(instance.subscriber_id, instance.target_user_id)
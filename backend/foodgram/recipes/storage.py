@@ -0,0 +1,79 @@
+import posixpath
+from hashlib import sha256
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище, называющее файлы по sha256 содержимого.
+
+    Одинаковые загрузки сохраняются один раз, а имя файла меняется
+    вместе с содержимым, поэтому URL можно кэшировать бессрочно.
+    Файл удаляется, только когда на него ссылается не больше одной
+    записи в полях ``reference_fields``. Файлы в каталогах
+    ``exclude_dirs`` (производные изображения, чьи имена уже получены
+    из имени оригинала) сохраняются под переданным именем.
+    """
+
+    reference_fields = (
+        ('recipes.CookingRecipe', 'picture'),
+        ('recipes.User', 'avatar'),
+    )
+    exclude_dirs = ('derivatives',)
+
+    def __init__(self, *args, allow_overwrite=True, **kwargs):
+        super().__init__(*args, allow_overwrite=allow_overwrite, **kwargs)
+
+    def is_content_addressed(self, name):
+        directories = posixpath.dirname(name).split('/')
+        return not any(directory in self.exclude_dirs for directory in directories)
+
+    def hashed_name(self, name, content):
+        digest = sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(
+            posixpath.dirname(name), digest[:2], f'{digest}{extension}'
+        )
+
+    def get_available_name(self, name, max_length=None):
+        if self.is_content_addressed(name):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not self.is_content_addressed(name):
+            return super()._save(name, content)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+    def reference_count(self, name, limit):
+        """Число записей, ссылающихся на файл, но не больше limit.
+        Поля проиндексированы, и LIMIT избавляет от полного подсчёта."""
+        count = 0
+        for model, field in self.reference_fields:
+            if count >= limit:
+                break
+            count += len(
+                apps.get_model(model).objects.filter(**{field: name})
+                .order_by().values_list('pk', flat=True)[:limit - count]
+            )
+        return count
+
+    def is_shared(self, name):
+        return self.reference_count(name, 2) > 1
+
+    def is_used(self, name):
+        return self.reference_count(name, 1) > 0
+
+    def delete(self, name):
+        if self.is_content_addressed(name) and self.is_shared(name):
+            return
+        super().delete(name)
@@ -1,2 +1,334 @@
+import json
+import os
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from api.cache import get_generation
+from api.nplusone import NPlusOneTestMixin
+from .models import (
+    CookingRecipe, FavoriteRecipe, FeedEntry, ProductComponent,
+    RecipeComponent, ShoppingCart, User, UserSubscription
+)
+from .component_index import get_version
+from .counters import reconcile_counters
+from .ingredient_index import ingredient_index
+from .short_links import short_link_hits, short_link_index
+from .storage import ContentAddressedStorage
+
+# Сессия, пользователь, COUNT, страница и по запросу на каждый фильтр
+# по связанной модели; у продуктов ещё полный COUNT и значения
+# unit_type для фильтра, у рецептов — prefetch продуктов.
+ADMIN_CHANGELISTS = {
+    'recipes_user': 4,
+    'recipes_usersubscription': 6,
+    'recipes_productcomponent': 6,
+    'recipes_cookingrecipe': 7,
+    'recipes_recipecomponent': 6,
+    'recipes_favoriterecipe': 5,
+    'recipes_shoppingcart': 5,
+}
+
+
+class AdminChangelistQueriesTest(NPlusOneTestMixin, TestCase):
+    """Число запросов списков админки фиксировано и не зависит
+    от числа строк"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            email='admin@foodgram.ru', username='admin',
+            first_name='Админ', last_name='Админов', password='Pa$$w0rd!'
+        )
+        cls.components = ProductComponent.objects.bulk_create(
+            ProductComponent(title=f'продукт {index}', unit_type='г')
+            for index in range(3)
+        )
+
+    def add_rows(self, prefix):
+        users = [
+            User.objects.create_user(
+                email=f'{prefix}{index}@foodgram.ru',
+                username=f'{prefix}{index}',
+                first_name='Иван', last_name='Иванов'
+            )
+            for index in range(3)
+        ]
+        for author in users:
+            recipe = CookingRecipe.objects.create(
+                creator=author, title=f'Рецепт {author.username}',
+                description='Сварить', cook_duration=10, picture='dish.png'
+            )
+            for component in self.components:
+                RecipeComponent.objects.create(
+                    recipe=recipe, component=component, quantity=1
+                )
+            for user in users:
+                FavoriteRecipe.objects.create(user=user, recipe=recipe)
+                ShoppingCart.objects.create(user=user, recipe=recipe)
+                if user != author:
+                    UserSubscription.objects.create(
+                        subscriber=user, target_user=author
+                    )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_changelist_queries_are_bounded(self):
+        self.client.force_login(self.admin)
+        expected = {
+            reverse(f'admin:{changelist}_changelist'): queries
+            for changelist, queries in ADMIN_CHANGELISTS.items()
+        }
+        for prefix in ('first', 'second'):
+            self.add_rows(prefix)
+            for url, queries in expected.items():
+                with self.subTest(url=url, rows=prefix):
+                    self.assertEqual(self.count_queries(url), queries)
+
+
+class ContentAddressedStorageTest(TestCase):
+    """Одинаковое содержимое хранится один раз и удаляется последним"""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.storage = ContentAddressedStorage(location=self.media.name)
+
+    def tearDown(self):
+        self.media.cleanup()
+
+    def test_identical_uploads_share_file(self):
+        first = self.storage.save('users/avatars/a.png', ContentFile(b'avatar'))
+        second = self.storage.save('users/avatars/b.PNG', ContentFile(b'avatar'))
+        other = self.storage.save('users/avatars/c.png', ContentFile(b'other'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertTrue(first.endswith('.png'))
+
+    def test_delete_keeps_referenced_file(self):
+        name = self.storage.save('users/avatars/a.png', ContentFile(b'avatar'))
+        for index in range(2):
+            User.objects.create_user(
+                email=f'user{index}@foodgram.ru', username=f'user{index}',
+                first_name='Иван', last_name='Иванов', avatar=name
+            )
+        self.storage.delete(name)
+        self.assertTrue(self.storage.exists(name))
+        User.objects.filter(username='user0').update(avatar='')
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+
+class ImportIngredientsTest(TestCase):
+    """Повторный импорт не создаёт дубликатов и считает вставки точно"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def import_file(self, path):
+        output = StringIO()
+        call_command('import_ingredients', path=path, batch_size=2, stdout=output)
+        return output.getvalue()
+
+    def test_csv_and_json_are_upserted(self):
+        csv_path = self.write('ingredients.csv', 'соль,г\nсахар,г\nсоль,г\nмука\n')
+        json_path = self.write('ingredients.json', json.dumps([
+            {'name': 'сахар', 'measurement_unit': 'г'},
+            {'name': 'молоко', 'measurement_unit': 'мл'},
+        ], ensure_ascii=False))
+        self.assertIn(
+            'Импортировано 2 из 3 ингредиентов, пропущено 1 существующих '
+            'и повторов, некорректных строк: 1',
+            self.import_file(csv_path)
+        )
+        self.assertIn('Импортировано 1 из 2', self.import_file(json_path))
+        self.assertIn('Импортировано 0 из 3', self.import_file(csv_path))
+        self.assertEqual(
+            sorted(ProductComponent.objects.values_list('title', flat=True)),
+            ['молоко', 'сахар', 'соль']
+        )
+
+
+class SeedFoodgramTest(TestCase):
+    """Синтетические данные согласованы со счётчиками и лентами"""
+
+    def test_seed(self):
+        ProductComponent.objects.bulk_create(
+            ProductComponent(title=f'продукт {index}', unit_type='г')
+            for index in range(20)
+        )
+        author, reader = (
+            User.objects.create_user(
+                email=f'{username}@foodgram.ru', username=username,
+                first_name='Иван', last_name='Иванов'
+            )
+            for username in ('seed5', 'reader')
+        )
+        UserSubscription.objects.create(subscriber=reader, target_user=author)
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            CookingRecipe.objects.create(
+                creator=author, title='Щи', description='Сварить',
+                cook_duration=10, picture='dish.png'
+            )
+            generation, version = get_generation(), get_version()
+            call_command(
+                'seed_foodgram', users=8, recipes=30, subscriptions=3,
+                batch_size=7, stdout=StringIO()
+            )
+        self.assertNotEqual(get_generation(), generation)
+        self.assertNotEqual(get_version(), version)
+        self.assertEqual(
+            sorted(User.objects.filter(username__startswith='seed')
+                   .values_list('username', flat=True)),
+            sorted(f'seed{index}' for index in (5, *range(6, 14)))
+        )
+        self.assertTrue(FeedEntry.objects.filter(user=reader).exists())
+        self.assertEqual(CookingRecipe.objects.count(), 31)
+        self.assertEqual(
+            RecipeComponent.objects.values('recipe').distinct().count(), 30
+        )
+        self.assertFalse(any(reconcile_counters().values()))
+
+
+class ShortLinkTest(TestCase):
+    """Короткие ссылки разрешаются без запросов к БД"""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        short_link_index.invalidate()
+        short_link_hits.flush()
+        self.patch(short_link_index, 'refresh_interval', 60)
+        self.author = User.objects.create_user(
+            username='author', email='author@foodgram.ru', password='pass'
+        )
+
+    def patch(self, target, name, value):
+        self.addCleanup(setattr, target, name, getattr(target, name))
+        setattr(target, name, value)
+
+    def create_recipe(self, title='Суп'):
+        return CookingRecipe.objects.create(
+            creator=self.author, title=title, description='Сварить.',
+            cook_duration=10, picture=ContentFile(b'GIF89a', name='dish.gif')
+        )
+
+    def test_redirect_without_queries(self):
+        first = self.create_recipe()
+        url = reverse('short-link', kwargs={'code': first.short_code})
+        self.client.get(url)
+        second = self.create_recipe('Каша')
+        with self.assertNumQueries(0):
+            self.assertRedirects(
+                self.client.get(url), f'/recipes/{first.pk}/',
+                fetch_redirect_response=False
+            )
+            self.assertRedirects(
+                self.client.get(f'/s/{second.short_code}/'),
+                f'/recipes/{second.pk}/', fetch_redirect_response=False
+            )
+            self.assertEqual(self.client.get('/s/missing0/').status_code, 404)
+        second.delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.client.get(f'/s/{second.short_code}/').status_code, 404
+            )
+
+    def test_refresh_after_invalidate(self):
+        recipe = self.create_recipe()
+        short_link_index._ensure_built()
+        short_link_index.invalidate()
+        self.patch(short_link_index, 'refresh_interval', 0)
+        self.assertIsNone(short_link_index._refresh())
+        self.assertEqual(short_link_index.resolve(recipe.short_code), recipe.pk)
+
+    def test_hits_flushed_in_batches(self):
+        recipe = self.create_recipe()
+        url = f'/s/{recipe.short_code}/'
+        self.patch(short_link_hits, 'batch_size', 3)
+        for _ in range(2):
+            self.client.get(url)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.short_link_hits, 0)
+        self.client.get(url)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.short_link_hits, 3)
+
+
+class IngredientIndexTest(TestCase):
+    """Префиксный поиск продуктов по индексу в памяти"""
+
+    def setUp(self):
+        super().setUp()
+        ingredient_index.invalidate()
+        self.addCleanup(ingredient_index.invalidate)
+        ProductComponent.objects.bulk_create(
+            ProductComponent(title=title, unit_type='г')
+            for title in ('Соль морская', 'соль', 'Сахар', 'крупная соль')
+        )
+
+    def search(self, prefix, **kwargs):
+        return [item['title'] for item in ingredient_index.search(prefix, **kwargs)]
+
+    def test_prefix_matches_title_then_words(self):
+        self.assertEqual(
+            self.search('сол'), ['соль', 'Соль морская', 'крупная соль']
+        )
+        self.assertEqual(self.search('мор'), ['Соль морская'])
+        self.assertEqual(self.search('ль'), [])
+        self.assertEqual(self.search('  '), [])
+
+    def test_casefold(self):
+        self.assertEqual(self.search('СОЛЬ М'), ['Соль морская'])
+        self.assertEqual(self.search('саХ'), ['Сахар'])
+
+    def test_multi_word_prefix(self):
+        self.assertEqual(self.search('крупная со'), ['крупная соль'])
+        self.assertEqual(self.search('соль мор'), ['Соль морская'])
+        self.assertEqual(self.search('соль к'), [])
+
+    def test_limit(self):
+        ProductComponent.objects.bulk_create(
+            ProductComponent(title=f'сахар {index}', unit_type='г')
+            for index in range(settings.INGREDIENT_SEARCH_LIMIT + 10)
+        )
+        ingredient_index.invalidate()
+        self.assertEqual(
+            len(self.search('сах')), settings.INGREDIENT_SEARCH_LIMIT
+        )
+        self.assertEqual(self.search('сах', limit=2), ['Сахар', 'сахар 0'])
+
+    def test_invalidated_on_save(self):
+        self.assertEqual(self.search('пер'), [])
+        ProductComponent.objects.create(title='перец', unit_type='г')
+        self.assertEqual(self.search('пер'), ['перец'])
+        product = ProductComponent.objects.get(title='Сахар')
+        product.title = 'Сахарная пудра'
+        product.save()
+        self.assertEqual(self.search('сах'), ['Сахарная пудра'])
@@ -1,7 +1,12 @@
-from django.urls import path
+from django.conf import settings
+from django.urls import re_path
 from . import views
 
 
 urlpatterns = [
-    path('<int:recipe_id>/', views.redirect_to_recipe, name='short-link'),
-]
\ No newline at end of file
+    re_path(
+        r'^s/(?P<code>[0-9A-Za-z]+)/$',
+        views.aredirect_to_recipe if settings.ASYNC_VIEWS else views.redirect_to_recipe,
+        name='short-link'
+    ),
+]
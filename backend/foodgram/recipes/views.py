@@ -1,11 +1,31 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import redirect
 from django.http import Http404
 from django.utils.translation import gettext_lazy as _
-from .models import CookingRecipe
+from .short_links import short_link_hits, short_link_index
 
 
-def redirect_to_recipe(request, recipe_id):
-    if not CookingRecipe.objects.filter(id=recipe_id).exists():
-        raise Http404(_('Некорректная короткая ссылка: рецепт с id={} не найден').format(recipe_id))
-        
+def not_found(code):
+    return Http404(_('Некорректная короткая ссылка: рецепт с кодом {} не найден').format(code))
+
+
+def redirect_to_recipe(request, code):
+    recipe_id = short_link_index.resolve(code)
+    if recipe_id is None:
+        raise not_found(code)
+    if short_link_hits.hit(recipe_id):
+        short_link_hits.flush()
+    return redirect(f'/recipes/{recipe_id}/')
+
+
+async def aredirect_to_recipe(request, code):
+    """redirect_to_recipe для ASGI: код из кэша разрешается
+    без перехода в поток"""
+    recipe_id = short_link_index.cached(code)
+    if recipe_id is None:
+        recipe_id = await sync_to_async(short_link_index.resolve)(code)
+    if recipe_id is None:
+        raise not_found(code)
+    if short_link_hits.hit(recipe_id):
+        await sync_to_async(short_link_hits.flush)()
     return redirect(f'/recipes/{recipe_id}/')